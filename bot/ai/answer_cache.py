@@ -0,0 +1,119 @@
+import hashlib
+import json
+import re
+from dataclasses import dataclass
+
+import discord
+
+from bot.utils import normalize_question
+from bot.utils.cache import TTLCache
+from bot.utils.metrics import metrics
+from bot.utils.settings import (
+    ASK_ANSWER_CACHE_DISABLED_GUILDS,
+    ASK_ANSWER_CACHE_TTL,
+    OPENAI_CHAT_MODEL,
+)
+
+from .coalesce import is_personal
+from .prompts import DEFAULT_SYSTEM_PROMPT, DEFAULT_USER_PROMPT, SESSION_PROMPT
+from .tools import TOOL_DEFINITIONS
+
+ANSWER_CACHE_ENTRIES = 512
+
+# questions whose answer depends on when or where they are asked: the channel
+# context and the date are deliberately not part of the key, so these would be
+# answered from whatever was true the first time
+_VOLATILE = re.compile(
+    r"\b(today|tonight|tomorrow|yesterday|now|current(ly)?|latest|recent(ly)?|"
+    r"date|time|this (chat|channel|server|thread|conversation)|above|earlier|"
+    r"conversation|said|says|messages?|we|us|our)\b"
+)
+
+# anything that changes how the same question is answered: a new model, prompt
+# or tool set starts from an empty cache instead of serving the old answers
+_FINGERPRINT = hashlib.sha256(
+    json.dumps(
+        [
+            OPENAI_CHAT_MODEL,
+            DEFAULT_SYSTEM_PROMPT,
+            SESSION_PROMPT,
+            DEFAULT_USER_PROMPT,
+            TOOL_DEFINITIONS,
+        ],
+        sort_keys=True,
+    ).encode("utf-8")
+).hexdigest()[:16]
+
+
+@dataclass
+class CachedAnswer:
+    text: str
+    user_id: int
+    generation_seconds: float
+
+
+def answer_cache_key(interaction: discord.Interaction, question: str) -> tuple | None:
+    """Key an /ask answer is cached under, or None if it must not be cached."""
+    if ASK_ANSWER_CACHE_TTL <= 0:
+        return None
+
+    guild_id = interaction.guild.id if interaction.guild else None
+    if guild_id in ASK_ANSWER_CACHE_DISABLED_GUILDS:
+        return None
+
+    if is_personal(question, interaction.user) or _VOLATILE.search(question.casefold()):
+        return None
+
+    return guild_id, normalize_question(question), _FINGERPRINT
+
+
+class AnswerCache:
+    """Answers to evergreen /ask questions, reused until they expire.
+
+    Only answers the model gave without calling a tool and without images are
+    stored — those depend on nothing but the question — so a hit can skip the
+    model entirely. Entries are per guild, so opting a guild out or purging it
+    leaves the others alone.
+    """
+
+    def __init__(self, max_entries: int, ttl: float):
+        self._answers: TTLCache[CachedAnswer] = TTLCache(max_entries, ttl)
+        self._hits = 0
+        self._misses = 0
+
+    def __len__(self) -> int:
+        return len(self._answers)
+
+    @property
+    def hit_ratio(self) -> float:
+        lookups = self._hits + self._misses
+        return round(self._hits / lookups, 3) if lookups else 0.0
+
+    def get(self, key: tuple) -> CachedAnswer | None:
+        answer = self._answers.get(key)
+
+        if answer is None:
+            self._misses += 1
+            metrics.incr("ask.answer_cache.miss")
+            return None
+
+        self._hits += 1
+        metrics.incr("ask.answer_cache.hit")
+        metrics.observe("ask.answer_cache.saved_seconds", answer.generation_seconds)
+        return answer
+
+    def store(self, key: tuple, answer: CachedAnswer) -> None:
+        self._answers.set(key, answer)
+
+    def purge(self, guild_id: int | None = None, everywhere: bool = False) -> int:
+        """Drop the guild's answers, or all of them; returns how many went."""
+        keys = [key for key in self._answers.keys() if everywhere or key[0] == guild_id]
+        for key in keys:
+            self._answers.pop(key)
+
+        return len(keys)
+
+
+answer_cache = AnswerCache(ANSWER_CACHE_ENTRIES, ASK_ANSWER_CACHE_TTL)
+metrics.gauge("ask.answer_cache.entries", lambda: len(answer_cache))
+metrics.gauge("ask.answer_cache.hit_ratio", lambda: answer_cache.hit_ratio)
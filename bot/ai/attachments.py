@@ -0,0 +1,103 @@
+import asyncio
+import base64
+import hashlib
+import io
+
+import discord
+from PIL import Image, ImageOps
+
+from bot.utils.cache import SingleFlight, TTLCache
+from bot.utils.metrics import metrics
+from bot.utils.settings import ATTACHMENT_JPEG_QUALITY, ATTACHMENT_MAX_DIMENSION
+
+# keyed on the bytes, not the attachment URL: a reposted meme is a new upload
+# with a new URL but the same content
+IMAGE_CACHE_ENTRIES = 64
+IMAGE_CACHE_TTL = 3_600.0
+# a decompression bomb is rejected before it is decoded, not after
+MAX_IMAGE_PIXELS = 50_000_000
+
+_image_cache: TTLCache[str] = TTLCache(IMAGE_CACHE_ENTRIES, IMAGE_CACHE_TTL)
+_image_flights: SingleFlight[str] = SingleFlight()
+metrics.gauge("attachments.cache.entries", lambda: len(_image_cache))
+
+
+def _downscale(data: bytes) -> bytes:
+    """Fit an image within ATTACHMENT_MAX_DIMENSION and re-encode it as JPEG.
+
+    The model sees nothing a phone photo's full resolution adds over this, but
+    the original would be uploaded again on every round of the tool loop.
+    Transparency is flattened onto white, and EXIF rotation applied first so
+    the pixels face the way the user saw them.
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        if image.width * image.height > MAX_IMAGE_PIXELS:
+            raise ValueError("image is too large to process")
+
+        # lets the JPEG decoder skip straight to a reduced scale
+        image.draft("RGB", (ATTACHMENT_MAX_DIMENSION, ATTACHMENT_MAX_DIMENSION))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((ATTACHMENT_MAX_DIMENSION, ATTACHMENT_MAX_DIMENSION))
+
+        if image.mode in ("RGBA", "LA", "P"):
+            image = image.convert("RGBA")
+            background = Image.new("RGB", image.size, "white")
+            background.paste(image, mask=image.getchannel("A"))
+            image = background
+        elif image.mode != "RGB":
+            image = image.convert("RGB")
+
+        output = io.BytesIO()
+        image.save(output, "JPEG", quality=ATTACHMENT_JPEG_QUALITY, optimize=True)
+
+    return output.getvalue()
+
+
+def _encode(data: bytes) -> str:
+    try:
+        data = _downscale(data)
+    except Exception as e:
+        # not something Pillow can read; send it as before and let the model
+        # endpoint decide
+        print(f"Image downscale failed, sending original: {e}")
+
+    return base64.b64encode(data).decode("utf-8")
+
+
+async def _ingest(attachment: discord.Attachment) -> str:
+    data = await attachment.read()
+    key = hashlib.sha256(data).hexdigest()
+
+    cached = _image_cache.get(key)
+    if cached is not None:
+        metrics.incr("attachments.cache.hit")
+        return cached
+
+    # the same image attached twice to one /ask is only processed once
+    encoded, shared = await _image_flights.do(key, lambda: _process(key, data))
+    metrics.incr("attachments.coalesced" if shared else "attachments.cache.miss")
+
+    return encoded
+
+
+async def _process(key: str, data: bytes) -> str:
+    # decoding and resizing is CPU work; Pillow releases the GIL for most of
+    # it, so a thread keeps the event loop responsive without a process hop
+    encoded = await asyncio.to_thread(_encode, data)
+    metrics.observe("attachments.bytes.original", len(data))
+    metrics.observe("attachments.bytes.encoded", len(encoded) * 3 // 4)
+
+    _image_cache.set(key, encoded)
+    return encoded
+
+
+async def ingest_images(attachments: list[discord.Attachment | None]) -> list[str]:
+    """Download and downscale attachments concurrently, as base64 JPEGs.
+
+    Missing (None) attachments are skipped; the rest keep their order.
+    """
+    return list(
+        await asyncio.gather(
+            *(_ingest(attachment) for attachment in attachments if attachment)
+        )
+    )
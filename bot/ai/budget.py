@@ -0,0 +1,119 @@
+import json
+
+# a local estimate, not a tokenizer: English prose and JSON both average close
+# to four characters per token, and the budget only needs to be roughly right
+CHARS_PER_TOKEN = 4
+MESSAGE_OVERHEAD_TOKENS = 4  # role and framing around each message
+# what one high-detail image costs at the sizes Discord attachments usually
+# come in (a 1024px side is four 512px tiles plus the base charge)
+IMAGE_TOKENS = 765
+
+# an older tool result squeezed to this many characters still tells the model
+# what it looked up and roughly what came back
+SUMMARY_CHARS = 600
+ELIDED_RESULT = json.dumps(
+    {"elided": "Older tool result removed to fit the context budget."}
+)
+# web search results reach the model wrapped in this tag, marking them as data
+SEARCH_RESULTS_OPEN = "<search_results>"
+SEARCH_RESULTS_CLOSE = "</search_results>"
+
+
+def estimate_tokens(value) -> int:
+    """Rough token count of a message, a message list or any JSON-like value."""
+    if isinstance(value, str):
+        return -(-len(value) // CHARS_PER_TOKEN)
+
+    if isinstance(value, list):
+        return sum(estimate_tokens(item) for item in value)
+
+    if not isinstance(value, dict):
+        return 0
+
+    if value.get("type") == "image_url":
+        return IMAGE_TOKENS
+
+    tokens = MESSAGE_OVERHEAD_TOKENS if "role" in value else 0
+    for key, item in value.items():
+        if key not in ("role", "type"):
+            tokens += estimate_tokens(item)
+
+    return tokens
+
+
+def summarize_tool_result(content: str) -> str:
+    """Short stand-in for a tool result the model has already read once.
+
+    Search results keep their titles and links, fetches their URL and the
+    start of the answer — enough for the model to cite or re-fetch, without
+    paying for the full text again on every round.
+    """
+    wrapped = content.startswith(SEARCH_RESULTS_OPEN)
+    payload = content.removeprefix(SEARCH_RESULTS_OPEN).removesuffix(
+        SEARCH_RESULTS_CLOSE
+    )
+
+    try:
+        data = json.loads(payload)
+    except ValueError:
+        return content[:SUMMARY_CHARS]
+
+    if not isinstance(data, dict) or "error" in data:
+        return content[:SUMMARY_CHARS]
+
+    summary = {"compacted": True}
+
+    if isinstance(data.get("results"), list):
+        summary["query"] = data.get("query")
+        summary["results"] = [
+            {key: item.get(key) for key in ("title", "url") if key in item}
+            for item in data["results"]
+            if isinstance(item, dict)
+        ]
+    else:
+        for key, item in data.items():
+            summary[key] = item[:SUMMARY_CHARS] if isinstance(item, str) else item
+
+    summary = json.dumps(summary)[: SUMMARY_CHARS * 2]
+    if wrapped:
+        return f"{SEARCH_RESULTS_OPEN}{summary}{SEARCH_RESULTS_CLOSE}"
+
+    return summary
+
+
+def fit_tool_messages(messages: list[dict], start: int, total: int, budget: int) -> int:
+    """Shrink older tool results in place until `total` tokens fit `budget`.
+
+    `messages[start:]` is the tool loop; everything before it (prompts,
+    context, images) is never touched. Results are first summarized, then, if
+    that isn't enough, replaced by a stub — oldest first, and never those of
+    the latest round, which the model hasn't seen yet. Messages are only ever
+    rewritten, not removed, so every tool_call keeps the tool result the API
+    requires to follow it. A result already shrunk stays shrunk.
+
+    Returns the new estimated total.
+    """
+    if total <= budget:
+        return total
+
+    # results after the last assistant message belong to the current round
+    latest = max(
+        (i for i in range(start, len(messages)) if messages[i].get("role") != "tool"),
+        default=len(messages),
+    )
+    older = [i for i in range(start, latest) if messages[i].get("role") == "tool"]
+
+    for shrink in (summarize_tool_result, lambda _: ELIDED_RESULT):
+        for i in older:
+            if total <= budget:
+                return total
+
+            content = messages[i]["content"]
+            replacement = shrink(content)
+            if len(replacement) >= len(content):
+                continue
+
+            total += estimate_tokens(replacement) - estimate_tokens(content)
+            messages[i] = {**messages[i], "content": replacement}
+
+    return total
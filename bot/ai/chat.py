@@ -1,93 +1,380 @@
+import asyncio
+import hashlib
+from collections.abc import Awaitable, Callable
 from datetime import datetime, timezone
 
-from discord import Interaction, Status
+from discord import Interaction
+from openai.types import CompletionUsage
+from openai.types.chat import ChatCompletionMessage, ChatCompletionMessageToolCall
 
-from bot.utils.settings import OPENAI_CHAT_MODEL
+from bot.utils import normalize_question
+from bot.utils.cache import TTLCache
+from bot.utils.metrics import metrics
+from bot.utils.settings import (
+    ASK_INPUT_TOKEN_BUDGET,
+    OPENAI_API_BASE_URL,
+    OPENAI_CHAT_MODEL,
+)
 
-from .openai_client import client
-from .prompts import DEFAULT_SYSTEM_PROMPT, DEFAULT_USER_PROMPT, WEB_EXTRACTION_PROMPT
+from .budget import estimate_tokens, fit_tool_messages
+from .history import channel_history
+from .openai_client import client, openai_gate
+from .presence import presence_index
+from .prompts import (
+    DEFAULT_SYSTEM_PROMPT,
+    DEFAULT_USER_PROMPT,
+    EXTRACTION_COMPLETE_MARKER,
+    EXTRACTION_NOT_FOUND_MARKER,
+    SESSION_PROMPT,
+    WEB_EXTRACTION_CHUNK_PROMPT,
+    WEB_EXTRACTION_PROMPT,
+    WEB_EXTRACTION_REDUCE_PROMPT,
+)
+from .ratelimit import INTERACTIVE
 
+# keyed on the page content itself, so a page that changed misses naturally;
+# the TTL only bounds how long an answer about an unchanged page is trusted
+EXTRACTION_CACHE_TTL = 1_800.0
+EXTRACTION_CACHE_ENTRIES = 512
+ASK_PROMPT_CACHE_KEY = "elongpt-ask"
 
-async def get_chat_completion(
-    prompt: str,
-    user_name: str,
-    files: list | None = None,
-    context: str = "",
-    tools: list | None = None,
-    tool_choice: str | None = None,
-    tool_messages: list | None = None,
-):
-    capped_files = files[:5] if files else []
-    today_date = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M UTC")
+_extraction_cache: TTLCache[str] = TTLCache(
+    EXTRACTION_CACHE_ENTRIES, EXTRACTION_CACHE_TTL
+)
+metrics.gauge("webfetch.extraction.cache.entries", lambda: len(_extraction_cache))
 
-    messages = [
-        {
-            "role": "developer",
-            "content": DEFAULT_SYSTEM_PROMPT.format(
-                user_name=user_name,
-                today_date=today_date,
-            ),
-        },
-        {
-            "role": "user",
-            "content": [
-                {
-                    "type": "text",
-                    "text": DEFAULT_USER_PROMPT.format(
-                        context=context, user_message=prompt
-                    ),
-                },
-                *[
+
+def _record_usage(kind: str, usage: CompletionUsage | None) -> None:
+    """Record prompt and cached-prefix token counts for one completion."""
+    if usage is None:
+        return
+
+    details = usage.prompt_tokens_details
+    cached = (details.cached_tokens if details else None) or 0
+
+    metrics.incr(f"openai.{kind}.prompt_tokens", usage.prompt_tokens)
+    metrics.incr(f"openai.{kind}.cached_tokens", cached)
+    print(
+        f"OpenAI {kind}: {usage.prompt_tokens} prompt tokens, "
+        f"{cached} from cached prefix"
+    )
+
+
+class Conversation:
+    """The messages of one /ask, built once and extended in place.
+
+    The prompts, context and image parts (possibly megabytes of base64) are
+    formatted a single time; each tool round then appends its turns to the same
+    list, and request() hands that very list to the client. Nothing is
+    rebuilt or copied per round, and the token estimate is kept as a running
+    total instead of being recounted.
+    """
+
+    def __init__(
+        self,
+        prompt: str,
+        user_name: str,
+        files: list | None = None,
+        context: str = "",
+        tools: list | None = None,
+    ):
+        capped_files = files[:5] if files else []
+        today_date = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M UTC")
+
+        # tools and the system prompt come first and never change, so every
+        # round of every /ask shares one cacheable prefix; the rest follows
+        self.messages: list[dict] = [
+            {"role": "developer", "content": DEFAULT_SYSTEM_PROMPT},
+            {
+                "role": "developer",
+                "content": SESSION_PROMPT.format(
+                    user_name=user_name,
+                    today_date=today_date,
+                ),
+            },
+            {
+                "role": "user",
+                "content": [
                     {
-                        "type": "image_url",
-                        "image_url": {
-                            "url": f"data:image/jpeg;base64,{image}",
-                        },
-                    }
-                    for image in capped_files
+                        "type": "text",
+                        "text": DEFAULT_USER_PROMPT.format(
+                            context=context, user_message=prompt
+                        ),
+                    },
+                    *[
+                        {
+                            "type": "image_url",
+                            "image_url": {
+                                "url": f"data:image/jpeg;base64,{image}",
+                            },
+                        }
+                        for image in capped_files
+                    ],
                 ],
-            ],
-        },
-    ]
+            },
+        ]
+        self.tools = tools
+        self._tool_loop_start = len(self.messages)
+        self.tokens = estimate_tokens(self.messages) + estimate_tokens(tools or [])
+
+    def add_tool_round(self, message: ChatCompletionMessage, results: list[str]):
+        """Append an assistant tool-call turn and its results, in call order."""
+        turns = [message.to_dict()]
+        turns.extend(
+            {"role": "tool", "tool_call_id": tc.id, "content": result}
+            for tc, result in zip(message.tool_calls, results)
+        )
+
+        self.messages.extend(turns)
+        self.tokens += estimate_tokens(turns)
+
+    def request(self, tool_choice: str | None = None) -> dict:
+        # the tool loop re-sends every earlier round, so without a budget the
+        # prompt grows with each one; older tool results give way first
+        self.tokens = fit_tool_messages(
+            self.messages, self._tool_loop_start, self.tokens, ASK_INPUT_TOKEN_BUDGET
+        )
+
+        metrics.observe("ask.input_tokens.estimate", self.tokens)
+        print(
+            f"Chat request: ~{self.tokens} input tokens "
+            f"({len(self.messages) - self._tool_loop_start} tool loop messages)"
+        )
+
+        kwargs = {"model": OPENAI_CHAT_MODEL, "messages": self.messages}
+
+        # routes /ask requests to the same cache (the prefix still has to
+        # match). OpenAI-only, so not sent to a compatible server that may
+        # reject it
+        if OPENAI_API_BASE_URL is None:
+            kwargs["prompt_cache_key"] = ASK_PROMPT_CACHE_KEY
 
-    if tool_messages:
-        messages.extend(tool_messages)
+        if self.tools:
+            kwargs["tools"] = self.tools
 
-    kwargs = {"model": OPENAI_CHAT_MODEL, "messages": messages}
+            if tool_choice:
+                kwargs["tool_choice"] = tool_choice
 
-    if tools:
-        kwargs["tools"] = tools
+        return kwargs
 
-        if tool_choice:
-            kwargs["tool_choice"] = tool_choice
 
-    completion = await client.chat.completions.create(**kwargs)
+async def get_chat_completion(
+    conversation: Conversation, tool_choice: str | None = None
+) -> ChatCompletionMessage:
+    kwargs = conversation.request(tool_choice)
+    completion = await openai_gate.call(
+        lambda: client.chat.completions.create(**kwargs),
+        priority=INTERACTIVE,
+        tokens=conversation.tokens,
+    )
+    _record_usage("ask", completion.usage)
 
     return completion.choices[0].message
 
 
-async def run_web_extraction(prompt: str, content: str) -> str:
+async def stream_chat_completion(
+    conversation: Conversation,
+    on_text: Callable[[str], Awaitable[None]],
+    tool_choice: str | None = None,
+) -> ChatCompletionMessage:
+    """Streaming twin of get_chat_completion, returning the same message shape.
+
+    `on_text` is awaited with the answer accumulated so far each time a content
+    delta arrives. Tool-call deltas are stitched back together by index, so the
+    /ask tool loop can treat the result exactly like a non-streamed message.
+    Text stops being forwarded once a tool call starts: any content in such a
+    round is a preamble ("let me search..."), not the answer.
+    """
+    kwargs = conversation.request(tool_choice)
+    # usage arrives on a final chunk only when asked for. OpenAI-only, like
+    # prompt_cache_key: a compatible server may reject the field, and then
+    # the round simply goes unmetered
+    if OPENAI_API_BASE_URL is None:
+        kwargs["stream_options"] = {"include_usage": True}
+
+    content = ""
+    tool_calls: dict[int, dict] = {}
+
+    async with openai_gate.stream(
+        lambda: client.chat.completions.create(**kwargs, stream=True),
+        priority=INTERACTIVE,
+        tokens=conversation.tokens,
+    ) as stream:
+        async for chunk in stream:
+            if chunk.usage is not None:
+                _record_usage("ask", chunk.usage)  # the final, choice-less chunk
+
+            if not chunk.choices:
+                continue
+
+            delta = chunk.choices[0].delta
+
+            for tc in delta.tool_calls or []:
+                call = tool_calls.setdefault(
+                    tc.index, {"id": "", "name": "", "arguments": ""}
+                )
+                if tc.id:
+                    call["id"] = tc.id
+                if tc.function and tc.function.name:
+                    call["name"] += tc.function.name
+                if tc.function and tc.function.arguments:
+                    call["arguments"] += tc.function.arguments
+
+            if delta.content:
+                content += delta.content
+                if not tool_calls:
+                    await on_text(content)
+
+    return ChatCompletionMessage(
+        role="assistant",
+        content=content or None,
+        tool_calls=[
+            ChatCompletionMessageToolCall(
+                id=call["id"],
+                type="function",
+                function={"name": call["name"], "arguments": call["arguments"]},
+            )
+            for _, call in sorted(tool_calls.items())
+        ]
+        or None,
+    )
+
+
+def _extraction_key(
+    prompt: str, content: str, instructions: str
+) -> tuple[str, str, str]:
+    normalized = normalize_question(prompt)
+    digest = hashlib.sha256(content.encode("utf-8")).hexdigest()
+    # a map-step answer carries markers a whole-page answer doesn't
+    variant = hashlib.sha256(instructions.encode("utf-8")).hexdigest()[:16]
+
+    return digest, normalized, variant
+
+
+async def run_web_extraction(
+    prompt: str, content: str, instructions: str = WEB_EXTRACTION_PROMPT
+) -> str:
     """Answer a question about one fetched web page, using only that page.
 
     Deliberately skips DEFAULT_SYSTEM_PROMPT so the model concentrates on the
     page rather than the bot persona. It also keeps the page markdown out of the
     /ask conversation, which re-sends every accumulated tool message on each
     round of its tool loop.
+
+    Answers are memoized per (page content, normalized prompt): the helper call
+    is the slowest step of a WebFetch, and the same popular page is often asked
+    the same thing by several users in a row.
     """
-    completion = await client.chat.completions.create(
-        model=OPENAI_CHAT_MODEL,
-        messages=[
-            {"role": "developer", "content": WEB_EXTRACTION_PROMPT},
-            {
-                "role": "user",
-                "content": (
-                    f"Request: {prompt}\n\n"
-                    f"<page_content>\n{content}\n</page_content>"
-                ),
-            },
-        ],
+    key = _extraction_key(prompt, content, instructions)
+    cached = _extraction_cache.get(key)
+    if cached is not None:
+        metrics.incr("webfetch.extraction.cache.hit")
+        return cached
+
+    metrics.incr("webfetch.extraction.cache.miss")
+    messages = [
+        {"role": "developer", "content": instructions},
+        {
+            "role": "user",
+            "content": (
+                f"Request: {prompt}\n\n" f"<page_content>\n{content}\n</page_content>"
+            ),
+        },
+    ]
+    completion = await openai_gate.call(
+        lambda: client.chat.completions.create(
+            model=OPENAI_CHAT_MODEL, messages=messages
+        ),
+        tokens=estimate_tokens(messages),
     )
 
+    _record_usage("extraction", completion.usage)
+    result = completion.choices[0].message.content or ""
+    if result:
+        _extraction_cache.set(key, result)
+
+    return result
+
+
+async def run_map_reduce_extraction(
+    prompt: str, chunks: list[str], concurrency: int
+) -> str:
+    """Answer a question about a page too long for one extraction call.
+
+    Each chunk is read by run_web_extraction concurrently, at most
+    `concurrency` at a time, so wall-clock time stays near a single helper
+    call. A chunk that answers the request on its own ends the run early and
+    cancels the rest; chunks with nothing relevant are dropped; what remains is
+    merged by one reduce call, or returned as-is when only one chunk had
+    anything to say.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def read_chunk(index: int, chunk: str) -> tuple[int, str | None]:
+        async with semaphore:
+            try:
+                answer = await run_web_extraction(
+                    prompt,
+                    f"(part {index + 1} of {len(chunks)})\n\n{chunk}",
+                    instructions=WEB_EXTRACTION_CHUNK_PROMPT,
+                )
+            except Exception as e:
+                print(f"Extraction of part {index + 1} failed: {e}")
+                return index, None
+
+        return index, answer.strip()
+
+    tasks = [asyncio.create_task(read_chunk(i, c)) for i, c in enumerate(chunks)]
+    partials: dict[int, str] = {}
+    failures = 0
+
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            index, answer = await next_done
+
+            if answer is None:
+                failures += 1
+            elif answer.startswith(EXTRACTION_COMPLETE_MARKER):
+                metrics.incr("webfetch.mapreduce.early_exit")
+                return answer.removeprefix(EXTRACTION_COMPLETE_MARKER).strip()
+            elif answer and not answer.startswith(EXTRACTION_NOT_FOUND_MARKER):
+                partials[index] = answer
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    if failures == len(chunks):
+        raise RuntimeError("Extraction failed for every part of the page.")
+
+    if not partials:
+        return "The page does not contain anything relevant to this request."
+
+    if len(partials) == 1:
+        return next(iter(partials.values()))
+
+    metrics.incr("webfetch.mapreduce.reduce")
+    combined = "\n".join(
+        f'<part n="{index + 1}">\n{answer}\n</part>'
+        for index, answer in sorted(partials.items())
+    )
+    messages = [
+        {"role": "developer", "content": WEB_EXTRACTION_REDUCE_PROMPT},
+        {
+            "role": "user",
+            "content": (
+                f"Request: {prompt}\n\n"
+                f"<partial_answers>\n{combined}\n</partial_answers>"
+            ),
+        },
+    ]
+    completion = await openai_gate.call(
+        lambda: client.chat.completions.create(
+            model=OPENAI_CHAT_MODEL, messages=messages
+        ),
+        tokens=estimate_tokens(messages),
+    )
+    _record_usage("extraction", completion.usage)
+
     return completion.choices[0].message.content or ""
 
 
@@ -97,30 +384,12 @@ async def get_chat_context(
     context = ""
 
     if interaction.guild is not None:
-        online_statuses = {
-            Status.online,
-            Status.idle,
-            Status.dnd,
-        }
-
-        online_users = [
-            member.display_name
-            for member in interaction.guild.members
-            if not member.bot and member.status in online_statuses
-        ]
-
-        if online_users:
-            context += f"Online users: {', '.join(online_users)}\n\n"
+        context += presence_index.line(interaction.guild)
 
-        messages = [msg async for msg in interaction.channel.history(limit=10)]
-        messages.reverse()
+        messages = await channel_history.recent(interaction.channel)
 
         if messages:
-            lines = [
-                f"[{msg.author.display_name}] {msg.content}"
-                for msg in messages
-                if msg.content
-            ]
+            lines = [f"[{msg.author}] {msg.content}" for msg in messages if msg.content]
 
             if lines:
                 context += "Recent messages in this channel:\n" + "\n".join(lines)
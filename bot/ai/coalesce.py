@@ -0,0 +1,97 @@
+import hashlib
+import re
+from collections.abc import Awaitable, Callable
+
+import discord
+
+from bot.utils import normalize_question
+from bot.utils.cache import SingleFlight, TTLCache
+from bot.utils.metrics import metrics
+from bot.utils.settings import ASK_COALESCE_DISABLED_GUILDS, ASK_COALESCE_WINDOW
+
+RECENT_ANSWER_ENTRIES = 128
+
+# an answer about "me" or "my ..." depends on who asked, so it can't be shared
+_FIRST_PERSON = re.compile(r"\b(i|me|my|mine|myself|i'm|i've|i'd|i'll)\b")
+
+
+def is_personal(question: str, user: discord.abc.User) -> bool:
+    """True if the question is about the asker, by mention, name or pronoun."""
+    text = question.casefold()
+
+    if f"<@{user.id}>" in text or f"<@!{user.id}>" in text:
+        return True
+
+    names = {user.name, getattr(user, "display_name", None), user.global_name}
+    for name in filter(None, names):
+        if re.search(rf"(?<!\w){re.escape(name.casefold())}(?!\w)", text):
+            return True
+
+    return _FIRST_PERSON.search(text) is not None
+
+
+def coalesce_key(
+    interaction: discord.Interaction, question: str, images: list[str]
+) -> tuple | None:
+    """Key identical /ask requests share an answer under, or None for no sharing.
+
+    Identical means the same question (ignoring case, spacing and trailing
+    punctuation) in the same channel with the same images. None when
+    coalescing is off, off for the guild, or the question is about the asker.
+    """
+    if ASK_COALESCE_WINDOW <= 0 or interaction.guild is None:
+        return None
+
+    if interaction.guild.id in ASK_COALESCE_DISABLED_GUILDS:
+        return None
+
+    if is_personal(question, interaction.user):
+        return None
+
+    image_hashes = tuple(
+        hashlib.sha256(image.encode("ascii")).hexdigest() for image in images
+    )
+
+    return interaction.channel_id, normalize_question(question), image_hashes
+
+
+class AskCoalescer:
+    """Lets identical /ask requests share one tool loop and one answer.
+
+    The first request for a key (the leader) runs; any identical request that
+    arrives while it is in flight, or within the window after it finished,
+    gets the leader's answer instead of running its own loop. Failures and
+    empty answers are not kept, so the next request tries again.
+    """
+
+    def __init__(self, window: float):
+        self._flights: SingleFlight[str] = SingleFlight()
+        self._recent: TTLCache[str] = TTLCache(RECENT_ANSWER_ENTRIES, window)
+
+    def has_answer(self, key: tuple) -> bool:
+        """True if `key` would be answered by someone else's request."""
+        return key in self._flights or self._recent.get(key) is not None
+
+    async def run(
+        self, key: tuple, answer: Callable[[], Awaitable[str]]
+    ) -> tuple[str, bool]:
+        """Return (answer, shared), running `answer` only as the leader."""
+        recent = self._recent.get(key)
+        if recent is not None:
+            metrics.incr("ask.coalesce.recent")
+            return recent, True
+
+        response, shared = await self._flights.do(key, lambda: self._lead(key, answer))
+        metrics.incr("ask.coalesce.follower" if shared else "ask.coalesce.leader")
+
+        return response, shared
+
+    async def _lead(self, key: tuple, answer: Callable[[], Awaitable[str]]) -> str:
+        response = await answer()
+        if response:
+            self._recent.set(key, response)
+
+        return response
+
+
+ask_coalescer = AskCoalescer(ASK_COALESCE_WINDOW)
@@ -0,0 +1,182 @@
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from urllib.parse import urlsplit, urlunsplit
+
+import httpx
+
+from bot.utils.metrics import metrics
+
+DEFAULT_TTL = 300.0  # for responses that say nothing about freshness
+MAX_TTL = 3_600.0  # even a year-long max-age is only trusted for an hour
+MAX_ENTRIES = 256
+MAX_BYTES = 32_000_000  # counted as UTF-8 bytes of the stored text
+
+_DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+@dataclass
+class CachedPage:
+    final_url: str
+    content: str
+    size: int
+    expires_at: float
+    truncated: bool = False  # the page continued past what was stored
+    etag: str | None = None
+    last_modified: str | None = None
+
+    def is_fresh(self) -> bool:
+        return time.monotonic() < self.expires_at
+
+    def validators(self) -> dict[str, str]:
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+
+        return headers
+
+
+def normalize_url(url: str) -> str:
+    """Canonical cache key: lowercase scheme/host, no default port or fragment."""
+    parts = urlsplit(url)
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+
+    if parts.port and parts.port != _DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{parts.port}"
+
+    return urlunsplit((scheme, host, parts.path or "/", parts.query, ""))
+
+
+def _freshness(headers: httpx.Headers) -> float | None:
+    """Seconds the response may be reused for, or None if it must not be stored.
+
+    This is a cache shared by every user of the bot, so `private` is treated
+    like `no-store`, and `s-maxage` wins over `max-age` as RFC 9111 asks of
+    shared caches.
+    """
+    directives = {}
+    for part in headers.get("cache-control", "").lower().split(","):
+        name, _, value = part.strip().partition("=")
+        directives[name] = value.strip('"')
+
+    if "no-store" in directives or "private" in directives:
+        return None
+
+    if "no-cache" in directives:
+        return 0.0  # storable, but every reuse has to revalidate first
+
+    for name in ("s-maxage", "max-age"):
+        try:
+            ttl = float(directives[name])
+        except (KeyError, ValueError):
+            continue
+
+        try:
+            ttl -= float(headers.get("age", 0))
+        except ValueError:
+            pass
+
+        return min(max(ttl, 0.0), MAX_TTL)
+
+    return DEFAULT_TTL
+
+
+class FetchCache:
+    """LRU + TTL cache of converted WebFetch pages, bounded by entries and bytes.
+
+    Stores the text the fetch produced — Markdown for HTML — so a hit skips
+    both the download and the conversion. Expired entries that carry an ETag
+    or Last-Modified are kept for a conditional request, and a 304 reuses the
+    stored text without parsing anything.
+    """
+
+    def __init__(self, max_entries: int = MAX_ENTRIES, max_bytes: int = MAX_BYTES):
+        self._entries: OrderedDict[str, CachedPage] = OrderedDict()
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._bytes = 0
+
+    @property
+    def size_bytes(self) -> int:
+        return self._bytes
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def lookup(self, url: str) -> CachedPage | None:
+        """Return the entry for `url`, fresh or revalidatable, else None."""
+        key = normalize_url(url)
+        entry = self._entries.get(key)
+
+        if entry is None:
+            return None
+
+        # stale with nothing to revalidate against — only a full GET will do
+        if not entry.is_fresh() and not entry.validators():
+            self._remove(key)
+            return None
+
+        self._entries.move_to_end(key)
+        return entry
+
+    def store(
+        self,
+        url: str,
+        content: str,
+        headers: httpx.Headers,
+        truncated: bool = False,
+    ) -> None:
+        key = normalize_url(url)
+        ttl = _freshness(headers)
+        size = len(content.encode("utf-8"))
+
+        if ttl is None or size > self._max_bytes:
+            self._remove(key)
+            return
+
+        self._remove(key)
+        self._entries[key] = CachedPage(
+            final_url=url,
+            content=content,
+            size=size,
+            expires_at=time.monotonic() + ttl,
+            truncated=truncated,
+            etag=headers.get("etag"),
+            last_modified=headers.get("last-modified"),
+        )
+        self._bytes += size
+        metrics.incr("webfetch.cache.store")
+
+        while len(self._entries) > self._max_entries or self._bytes > self._max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= evicted.size
+            metrics.incr("webfetch.cache.evict")
+
+    def refresh(self, url: str, headers: httpx.Headers) -> None:
+        """Extend an entry after a 304, using the freshness the 304 carried."""
+        key = normalize_url(url)
+        entry = self._entries.get(key)
+        if entry is None:
+            return
+
+        ttl = _freshness(headers)
+        if ttl is None:
+            self._remove(key)
+            return
+
+        entry.expires_at = time.monotonic() + ttl
+        entry.etag = headers.get("etag", entry.etag)
+        entry.last_modified = headers.get("last-modified", entry.last_modified)
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.size
+
+
+fetch_cache = FetchCache()
+metrics.gauge("webfetch.cache.entries", lambda: len(fetch_cache))
+metrics.gauge("webfetch.cache.bytes", lambda: fetch_cache.size_bytes)
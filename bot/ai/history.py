@@ -0,0 +1,135 @@
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+
+import discord
+
+from bot.utils.cache import SingleFlight
+from bot.utils.metrics import metrics
+from bot.utils.settings import ASK_CONTEXT_CHANNELS, ASK_CONTEXT_MESSAGES
+
+# a Discord message tops out at 4000 characters with Nitro; context only needs
+# the gist, and the cap bounds memory at channels x window x this
+MAX_MESSAGE_CHARS = 1_000
+
+
+@dataclass
+class BufferedMessage:
+    id: int
+    author: str
+    content: str
+
+
+class _ChannelBuffer:
+    def __init__(self, window: int):
+        self.messages: deque[BufferedMessage] = deque(maxlen=window)
+        # True once the buffer is known to hold the channel's latest messages:
+        # after a history() backfill, or once events alone have filled it
+        self.warm = False
+
+    def append(self, message: BufferedMessage) -> None:
+        self.messages.append(message)
+        if len(self.messages) == self.messages.maxlen:
+            self.warm = True
+
+    def find(self, message_id: int) -> BufferedMessage | None:
+        for message in self.messages:
+            if message.id == message_id:
+                return message
+
+        return None
+
+
+def _buffered(message: discord.Message) -> BufferedMessage:
+    return BufferedMessage(
+        id=message.id,
+        author=message.author.display_name,
+        content=message.content[:MAX_MESSAGE_CHARS],
+    )
+
+
+class ChannelHistory:
+    """The last few messages of each active channel, kept from gateway events.
+
+    /ask used to call channel.history() every time — a REST round trip, rate
+    limited, before the model call could even start. Messages now arrive via
+    on_message and friends and sit in a bounded per-channel ring, so warm
+    channels cost no REST call at all. A channel the bot hasn't heard enough
+    of yet (cold start, or evicted) is backfilled with one history() call.
+
+    Memory is bounded by `window` messages per channel and `max_channels`
+    channels; the channel idle longest is evicted first.
+    """
+
+    def __init__(self, window: int, max_channels: int):
+        self._window = window
+        self._max_channels = max_channels
+        self._channels: OrderedDict[int, _ChannelBuffer] = OrderedDict()
+        self._backfills: SingleFlight[list[BufferedMessage]] = SingleFlight()
+
+    def __len__(self) -> int:
+        return len(self._channels)
+
+    def _buffer(self, channel_id: int) -> _ChannelBuffer:
+        buffer = self._channels.get(channel_id)
+
+        if buffer is None:
+            buffer = self._channels[channel_id] = _ChannelBuffer(self._window)
+            while len(self._channels) > self._max_channels:
+                self._channels.popitem(last=False)
+                metrics.incr("history.evict")
+
+        self._channels.move_to_end(channel_id)
+        return buffer
+
+    def add(self, message: discord.Message) -> None:
+        self._buffer(message.channel.id).append(_buffered(message))
+
+    def edit(self, channel_id: int, message_id: int, content: str) -> None:
+        buffer = self._channels.get(channel_id)
+        message = buffer.find(message_id) if buffer else None
+
+        if message is not None:
+            message.content = content[:MAX_MESSAGE_CHARS]
+
+    def delete(self, channel_id: int, message_ids: set[int]) -> None:
+        buffer = self._channels.get(channel_id)
+        if buffer is None:
+            return
+
+        kept = [message for message in buffer.messages if message.id not in message_ids]
+        if len(kept) != len(buffer.messages):
+            buffer.messages = deque(kept, maxlen=self._window)
+
+    async def recent(self, channel: discord.abc.Messageable) -> list[BufferedMessage]:
+        """The channel's latest messages, oldest first."""
+        buffer = self._buffer(channel.id)
+
+        if buffer.warm:
+            metrics.incr("history.hit")
+            return list(buffer.messages)
+
+        metrics.incr("history.backfill")
+        fetched, _ = await self._backfills.do(channel.id, lambda: self._fetch(channel))
+
+        # events that arrived while history() was in flight are newer than
+        # anything it returned, so they go after it
+        buffer = self._buffer(channel.id)
+        newest = fetched[-1].id if fetched else 0
+        merged = fetched + [m for m in buffer.messages if m.id > newest]
+
+        buffer.messages = deque(merged, maxlen=self._window)
+        buffer.warm = True
+
+        return list(buffer.messages)
+
+    async def _fetch(self, channel: discord.abc.Messageable) -> list[BufferedMessage]:
+        messages = [
+            _buffered(message) async for message in channel.history(limit=self._window)
+        ]
+        messages.reverse()
+
+        return messages
+
+
+channel_history = ChannelHistory(ASK_CONTEXT_MESSAGES, ASK_CONTEXT_CHANNELS)
+metrics.gauge("history.channels", lambda: len(channel_history))
@@ -0,0 +1,807 @@
+import asyncio
+import codecs
+import copy
+import re
+import signal
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from html.parser import HTMLParser
+
+from bs4 import BeautifulSoup, Tag
+from bs4.dammit import EncodingDetector
+from markdownify import MarkdownConverter
+
+from bot.utils.metrics import metrics
+from bot.utils.settings import (
+    HTML_CONVERT_MAX_QUEUE,
+    HTML_CONVERT_MEMORY_MB,
+    HTML_CONVERT_TIMEOUT,
+    HTML_CONVERT_WORKERS,
+)
+
+# a worker is replaced after this many pages, so whatever bs4/markdownify
+# leave behind on odd markup never accumulates for long
+JOBS_PER_WORKER = 50
+# extra time the event loop gives a job beyond the worker's own alarm, to cover
+# pickling the body over and the Markdown back
+TIMEOUT_GRACE = 2.0
+
+# Dropped before conversion. script/style/noscript/template because
+# markdownify's `strip` option keeps their inner text (inline JS/CSS leaks in);
+# nav/footer/aside/form because chrome otherwise eats the MAX_FETCH_CHARS budget
+# ahead of the article. `header` is left in — it often carries the title/byline.
+NON_CONTENT_TAGS = [
+    "script",
+    "style",
+    "noscript",
+    "template",
+    "nav",
+    "footer",
+    "aside",
+    "form",
+]
+
+
+# how much of the body to hold back for charset sniffing — the HTML spec has
+# browsers look for <meta charset> in the first 1024 bytes; a bit more catches
+# pages with a long run of comments or preload links ahead of it
+SNIFF_BYTES = 4_096
+
+_HEADINGS = {"h1": 1, "h2": 2, "h3": 3, "h4": 4, "h5": 5, "h6": 6}
+_PARAGRAPH_TAGS = {"p", "blockquote", "table", "figure", "details", "dl"}
+_LINE_TAGS = {
+    "div",
+    "section",
+    "article",
+    "main",
+    "header",
+    "tr",
+    "dt",
+    "dd",
+    "figcaption",
+    "summary",
+    "address",
+}
+_EMPHASIS = {"b": "**", "strong": "**", "i": "*", "em": "*", "code": "`"}
+_WHITESPACE = re.compile(r"\s+")
+
+# Readability's boilerplate hints, matched against class and id. Chrome that
+# isn't in NON_CONTENT_TAGS — sidebars and cookie banners built from divs,
+# related-article grids — is recognised by these, unless the same attributes
+# also look like content ("main-column", "article-body")
+UNLIKELY_HINTS = re.compile(
+    r"-ad-|banner|breadcrumb|comment|community|consent|cookie|disqus|footer|"
+    r"gdpr|menu|newsletter|pager|pagination|popup|promo|related|remark|"
+    r"replies|share|sharing|shoutbox|sidebar|skyscraper|social|sponsor|"
+    r"subscribe|supplemental",
+    re.IGNORECASE,
+)
+CONTENT_HINTS = re.compile(
+    r"and|article|body|column|content|entry|main|post|shadow|story|text",
+    re.IGNORECASE,
+)
+NEGATIVE_WEIGHT_HINTS = re.compile(
+    r"byline|caption|comment|footer|footnote|masthead|meta|outbrain|promo|"
+    r"related|scroll|share|shoutbox|sidebar|sponsor|shopping|tags|widget",
+    re.IGNORECASE,
+)
+POSITIVE_WEIGHT_HINTS = re.compile(
+    r"article|body|content|entry|hentry|main|page|post|text|blog|story",
+    re.IGNORECASE,
+)
+# containers the streaming converter may skip on a hint. All need an explicit
+# end tag — skipping a <p> or <li>, whose end tag is optional, could swallow
+# the rest of the page
+_HINT_SKIPPABLE_TAGS = {"div", "section", "ul", "ol", "table", "figure", "span"}
+_NEVER_PRUNED_TAGS = {"html", "body", "main", "article"}
+# what the streaming converter scores: containers that need an explicit end
+# tag, so its stack of open ones stays in step with the page, and the
+# paragraph-like blocks that score them
+_SCORED_CONTAINER_TAGS = {"div", "section", "article", "main", "blockquote"}
+_SCORED_BLOCK_TAGS = {"p", "pre", "blockquote"}
+
+# a main-content candidate below either bound is ignored and the whole page is
+# converted instead
+MIN_MAIN_SCORE = 20.0
+MIN_MAIN_CHARS = 500
+
+
+def _tidy(markdown: str) -> str:
+    return re.sub(r"\n{3,}", "\n\n", markdown).strip()
+
+
+class HtmlConversionError(Exception):
+    """A conversion failure whose message is meant to be handed to the model."""
+
+
+def _hint(attributes: dict) -> str:
+    classes = attributes.get("class") or ""
+    if isinstance(classes, list):  # bs4 splits class, html.parser doesn't
+        classes = " ".join(classes)
+
+    return f"{classes} {attributes.get('id') or ''}"
+
+
+def _looks_unlikely(attributes: dict) -> bool:
+    hint = _hint(attributes)
+    return bool(UNLIKELY_HINTS.search(hint)) and not CONTENT_HINTS.search(hint)
+
+
+def _initial_score(name: str, attributes: dict) -> float:
+    score = {
+        "div": 5,
+        "pre": 3,
+        "td": 3,
+        "blockquote": 3,
+        "address": -3,
+        "ol": -3,
+        "ul": -3,
+        "dl": -3,
+        "li": -3,
+        "form": -3,
+        "th": -5,
+    }.get(name, 0)
+
+    hint = _hint(attributes)
+    if NEGATIVE_WEIGHT_HINTS.search(hint):
+        score -= 25
+    if POSITIVE_WEIGHT_HINTS.search(hint):
+        score += 25
+
+    return score
+
+
+def _block_points(text: str) -> float:
+    """What a paragraph-like block adds to its parent's score: 0 if too short."""
+    if len(text) < 25:
+        return 0
+
+    return 1 + text.count(",") + min(len(text) // 100, 3)
+
+
+def _is_main(score: float, length: int) -> bool:
+    # below either bound the winner is more likely a teaser box than the article
+    return score >= MIN_MAIN_SCORE and length >= MIN_MAIN_CHARS
+
+
+def _link_density(tag: Tag, text_length: int) -> float:
+    link_length = sum(len(a.get_text(strip=True)) for a in tag.find_all("a"))
+    return link_length / text_length if text_length else 1.0
+
+
+def _select_main_content(soup: BeautifulSoup) -> Tag | None:
+    """Pick the subtree holding the article, Readability-style, or None.
+
+    Paragraph-like blocks of real prose score their parent (and half that to
+    the grandparent) by length and comma count; each candidate's score is then
+    discounted by how much of its text is link text, since navigation and
+    related-article grids are mostly links.
+    """
+    candidates: dict[int, list] = {}
+
+    for block in soup.find_all(["p", "pre", "td", "blockquote"]):
+        points = _block_points(block.get_text(" ", strip=True))
+        if not points:
+            continue
+
+        for level, ancestor in enumerate(block.parents):
+            if level > 1 or ancestor.name in (None, "[document]", "html"):
+                break
+
+            entry = candidates.setdefault(
+                id(ancestor), [ancestor, _initial_score(ancestor.name, ancestor.attrs)]
+            )
+            entry[1] += points if level == 0 else points / 2
+
+    best, best_score, best_length = None, 0.0, 0
+    for tag, score in candidates.values():
+        length = len(tag.get_text(" ", strip=True))
+        score *= 1 - _link_density(tag, length)
+
+        if score > best_score:
+            best, best_score, best_length = tag, score, length
+
+    if best is None or not _is_main(best_score, best_length):
+        return None
+
+    return best
+
+
+def _prune_unlikely(soup: BeautifulSoup) -> None:
+    for tag in soup.find_all(True):
+        if tag.decomposed or tag.name in _NEVER_PRUNED_TAGS:
+            continue
+        if _looks_unlikely(tag.attrs):
+            tag.decompose()
+
+
+def html_to_markdown(html: bytes) -> str:
+    """Convert a page body to Markdown. Blocking — run it via HtmlConverter.
+
+    Takes bytes rather than str so BeautifulSoup can sniff the encoding itself:
+    plenty of pages declare their charset only in <meta charset=...>, and
+    decoding those as UTF-8 up front turns them into mojibake the extraction
+    model then reads as fact.
+
+    When one subtree clearly holds the article only that subtree is converted
+    (under the page title); otherwise the whole page is, as before. Boilerplate
+    containers are pruned by class/id first, but on a copy: a page wrapper
+    named "with-sidebar" would take the article with it, so when the pruned
+    page has no winner it is scored again unpruned, as Readability retries.
+    """
+    soup = BeautifulSoup(html, "html.parser")
+    for tag in soup(NON_CONTENT_TAGS):
+        tag.decompose()
+
+    converter = MarkdownConverter()
+    title = soup.title.get_text(" ", strip=True) if soup.title else ""
+    pruned = copy.copy(soup)
+    _prune_unlikely(pruned)
+
+    for candidate in (pruned, soup):
+        main = _select_main_content(candidate)
+        if main is None:
+            continue
+
+        markdown = converter.convert_soup(main)
+        if len(markdown.strip()) >= MIN_MAIN_CHARS:
+            return f"# {title}\n\n{markdown}" if title else markdown
+
+    # convert_soup, not markdownify(str(soup)): the latter re-serializes the
+    # whole tree and markdownify parses it a second time, doubling the work
+    return converter.convert_soup(soup)
+
+
+@dataclass
+class _Mark:
+    """A point in the streaming converter's output, in both of its views."""
+
+    part: int
+    length: int
+    links: int
+    kept_length: int  # the same, leaving out pruned containers
+    kept_links: int
+
+
+@dataclass
+class _Container:
+    """A container the streaming converter scores, located by its output span."""
+
+    tag: str
+    score: float
+    kept_score: float
+    pruned: bool  # inside (or itself) a container pruned on a hint
+    start: _Mark
+    end: _Mark | None = None
+    scored: bool = False
+
+
+class StreamingMarkdownConverter(HTMLParser):
+    """Convert HTML to Markdown incrementally, as the body downloads.
+
+    Fed raw body chunks through feed_bytes(); emits Markdown as tags close
+    rather than building a tree, and never keeps the text inside
+    NON_CONTENT_TAGS or <head>. Once `budget` characters of Markdown exist,
+    `done` flips and the caller can stop downloading — everything past the
+    budget would be truncated anyway. `truncated` then tells whether what
+    finish() returned was cut short. The output is coarser than markdownify's
+    (tables flatten to pipe-separated rows), which the extraction model reads
+    just as well.
+
+    Main content is picked as in html_to_markdown, only without a tree: each
+    container remembers which stretch of the output it produced, blocks of
+    prose score the containers they sit in, and finish() returns just the
+    winner's stretch (under the page title) when one clearly wins. Containers
+    whose class/id marks them as boilerplate are written but set aside, so
+    the output can be read both pruned and whole: the pruned view is tried
+    first, and when it has no winner — the hint hit a page wrapper — the
+    whole one, as html_to_markdown retries. Only the pruned view counts
+    toward the budget.
+
+    Like html_to_markdown it takes bytes: the charset comes from a BOM, then
+    the Content-Type header, then a <meta charset> in the first SNIFF_BYTES.
+    """
+
+    def __init__(self, budget: int, charset: str | None = None):
+        super().__init__(convert_charrefs=True)
+        self.done = False
+        self.truncated = False
+        self._budget = budget
+        self._charset = charset
+        self._prefix = b""
+        self._decoder = None
+        self._parts: list[str] = []
+        self._length = 0
+        self._kept_length = 0
+        self._newlines = 0  # owed before the next text, collapsed to the max
+        self._skip_tag: str | None = None
+        self._skip_depth = 0
+        # the outermost container pruned on a hint, and the [first, last) part
+        # ranges pruned so far; the last range is open while inside one
+        self._prune_tag: str | None = None
+        self._prune_depth = 0
+        self._pruned: list[list] = []
+        self._pre = 0
+        self._lists: list[list] = []  # [tag, items so far] per open list
+        self._marker = -1  # part index of the last list marker written
+        self._link: tuple[str, list[str]] | None = None
+        self._cells = 0
+        self._link_chars = 0  # link text written so far, for link density
+        self._kept_link_chars = 0
+        self._containers: list[_Container] = []  # open ones, innermost last
+        self._scored: list[_Container] = []
+        # (first part, enclosing containers) of the open scored block
+        self._block: tuple[int, list[_Container]] | None = None
+        self._title_parts: list[str] | None = None
+        self._title = ""
+
+    def feed_bytes(self, chunk: bytes) -> None:
+        if self.done:
+            return
+
+        if self._decoder is None:
+            self._prefix += chunk
+            if len(self._prefix) < SNIFF_BYTES:
+                return
+
+            chunk, self._prefix = self._prefix, b""
+            self._decoder = self._make_decoder(chunk)
+
+        self.feed(self._decoder.decode(chunk))
+
+    def finish(self) -> str:
+        """Flush what is buffered and return the Markdown produced."""
+        if not self.done:
+            if self._decoder is None:
+                self._decoder = self._make_decoder(self._prefix)
+                self.feed(self._decoder.decode(self._prefix, final=True))
+            else:
+                self.feed(self._decoder.decode(b"", final=True))
+
+            self.close()
+
+        self._end_link()
+        self._end_block()
+        while self._containers:
+            self._close_container(self._containers.pop())
+        if self._prune_tag is not None:
+            self._pruned[-1][1] = len(self._parts)
+
+        # stopping at the budget may have cut the article or only what came
+        # after it; the page can't tell which, so either counts
+        self.truncated = self.done
+
+        for kept in (True, False):
+            main = self._main_content(kept)
+            if main is not None and len(main) >= MIN_MAIN_CHARS:
+                return f"# {self._title}\n\n{main}" if self._title else main
+
+        # the unpruned page can run past the budget, which only the pruned
+        # view is held to
+        markdown = "".join(self._parts)
+        if len(markdown) > self._budget:
+            self.truncated = True
+
+        return _tidy(markdown[: self._budget])
+
+    def _main_content(self, kept: bool) -> str | None:
+        best, best_score, best_length = None, 0.0, 0
+
+        for container in self._scored:
+            start, end = container.start, container.end
+            if kept and container.pruned:
+                continue
+            elif kept:
+                length = end.kept_length - start.kept_length
+                links = end.kept_links - start.kept_links
+                score = container.kept_score
+            else:
+                length = end.length - start.length
+                links = end.links - start.links
+                score = container.score
+
+            score *= 1 - (links / length if length else 1.0)
+            if score > best_score:
+                best, best_score, best_length = container, score, length
+
+        if best is None or not _is_main(best_score, best_length):
+            return None
+
+        return _tidy(self._text(best.start.part, best.end.part, kept))
+
+    def _text(self, start: int, end: int, kept: bool) -> str:
+        if not kept:
+            return "".join(self._parts[start:end])
+
+        pieces = []
+        for first, last in self._pruned:
+            last = len(self._parts) if last is None else last
+            if last <= start or first >= end:
+                continue
+
+            pieces.extend(self._parts[start:first])
+            start = last
+
+        pieces.extend(self._parts[start:end])
+        return "".join(pieces)
+
+    def _mark(self) -> _Mark:
+        return _Mark(
+            len(self._parts),
+            self._length,
+            self._link_chars,
+            self._kept_length,
+            self._kept_link_chars,
+        )
+
+    def _close_container(self, container: _Container) -> None:
+        container.end = self._mark()
+
+    def _end_block(self) -> None:
+        if self._block is None:
+            return
+
+        start, parents = self._block
+        self._block = None
+        end = len(self._parts)
+
+        points = _block_points(_WHITESPACE.sub(" ", self._text(start, end, False)))
+        if not points:
+            return
+        kept_points = _block_points(_WHITESPACE.sub(" ", self._text(start, end, True)))
+
+        # the parent gets the points, the grandparent half of them
+        for level, container in enumerate(reversed(parents)):
+            share = 1 if level == 0 else 0.5
+            container.score += points * share
+            container.kept_score += kept_points * share
+            if not container.scored:
+                container.scored = True
+                self._scored.append(container)
+
+    def _make_decoder(self, head: bytes):
+        encoding = (
+            EncodingDetector.find_declared_encoding(head, is_html=True)
+            if self._charset is None
+            else self._charset
+        )
+
+        for bom, name in ((codecs.BOM_UTF8, "utf-8-sig"), (codecs.BOM_UTF16, "utf-16")):
+            if head.startswith(bom):
+                encoding = name
+
+        try:
+            return codecs.getincrementaldecoder(encoding or "utf-8")(errors="replace")
+        except LookupError:
+            return codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+    def _break(self, newlines: int) -> None:
+        self._newlines = max(self._newlines, newlines)
+
+    def _break_block(self, newlines: int) -> None:
+        # <li><p>Step one</p> keeps its text on the bullet's line
+        if self._marker != len(self._parts) - 1 or self._newlines:
+            self._break(newlines)
+
+    def _write(self, text: str) -> None:
+        if self.done or not text:
+            return
+
+        if self._link is not None:
+            self._link[1].append(text)
+            return
+
+        if self._newlines and self._parts:
+            self._parts.append("\n" * self._newlines)
+            self._length += self._newlines
+        self._newlines = 0
+
+        self._parts.append(text)
+        self._length += len(text)
+        if self._prune_tag is None:
+            self._kept_length += len(text)
+
+        if self._kept_length >= self._budget:
+            self.done = True
+
+    def _end_link(self) -> None:
+        if self._link is None:
+            return
+
+        href, parts = self._link
+        self._link = None
+        text = _WHITESPACE.sub(" ", "".join(parts)).strip()
+
+        if text and href and not href.startswith(("#", "javascript:")):
+            self._write(f"[{text}]({href})")
+        else:
+            self._write(text)
+
+        self._link_chars += len(text)
+        if self._prune_tag is None:
+            self._kept_link_chars += len(text)
+
+    def handle_starttag(self, tag: str, attrs: list) -> None:
+        if self._skip_tag is not None:
+            if tag == self._skip_tag:
+                self._skip_depth += 1
+            # </head> may legally be left out, so the body starting ends it too
+            elif self._skip_tag == "head" and tag == "body":
+                self._skip_tag = None
+            elif self._skip_tag == "head" and tag == "title":
+                self._title_parts = []  # heads the main content, if one is picked
+            return
+
+        attributes = dict(attrs)
+
+        if tag in NON_CONTENT_TAGS or tag == "head":
+            self._skip_tag, self._skip_depth = tag, 1
+            return
+
+        if tag == self._prune_tag:
+            self._prune_depth += 1
+        elif (
+            self._prune_tag is None
+            and tag in _HINT_SKIPPABLE_TAGS
+            and _looks_unlikely(attributes)
+        ):
+            self._prune_tag, self._prune_depth = tag, 1
+            self._pruned.append([len(self._parts), None])
+
+        # a new block also ends an open <p>, whose end tag is optional
+        if tag in _SCORED_BLOCK_TAGS:
+            self._end_block()
+            self._block = (len(self._parts), self._containers[-2:])
+        if tag in _SCORED_CONTAINER_TAGS:
+            score = _initial_score(tag, attributes)
+            self._containers.append(
+                _Container(tag, score, score, self._prune_tag is not None, self._mark())
+            )
+
+        if tag in _HEADINGS:
+            self._break_block(2)
+            self._write("#" * _HEADINGS[tag] + " ")
+        elif tag in _PARAGRAPH_TAGS:
+            self._break_block(2)
+        elif tag in _LINE_TAGS:
+            self._break_block(1)
+            self._cells = 0
+        elif tag in ("ul", "ol"):
+            self._break(1)
+            self._lists.append([tag, 0])
+        elif tag == "li":
+            self._break(1)
+            indent = "  " * max(len(self._lists) - 1, 0)
+            if self._lists and self._lists[-1][0] == "ol":
+                self._lists[-1][1] += 1
+                self._write(f"{indent}{self._lists[-1][1]}. ")
+            else:
+                self._write(f"{indent}- ")
+            self._marker = len(self._parts) - 1
+        elif tag in ("td", "th"):
+            if self._cells:
+                self._write(" | ")
+            self._cells += 1
+        elif tag == "br":
+            self._break(1)
+        elif tag == "hr":
+            self._break(2)
+            self._write("---")
+            self._break(2)
+        elif tag == "pre":
+            self._break(2)
+            self._write("```")
+            self._break(1)
+            self._pre += 1
+        elif tag == "a":
+            self._end_link()  # an unclosed <a> before this one
+            self._link = (attributes.get("href") or "", [])
+        elif tag == "img":
+            alt = _WHITESPACE.sub(" ", attributes.get("alt") or "").strip()
+            if alt:
+                self._write(f"![{alt}]({attributes.get('src') or ''})")
+        elif tag in _EMPHASIS and not self._pre:
+            self._write(_EMPHASIS[tag])
+
+    def handle_endtag(self, tag: str) -> None:
+        if self._skip_tag is not None:
+            if tag == self._skip_tag:
+                self._skip_depth -= 1
+                if self._skip_depth == 0:
+                    self._skip_tag = None
+            elif tag == "title" and self._title_parts is not None:
+                self._title = _WHITESPACE.sub(" ", "".join(self._title_parts)).strip()
+                self._title_parts = None
+            return
+
+        if tag in _SCORED_BLOCK_TAGS or tag in _SCORED_CONTAINER_TAGS:
+            self._end_block()
+        if tag in _SCORED_CONTAINER_TAGS:
+            # a stray end tag with no open match is ignored, like browsers do
+            for depth in range(len(self._containers) - 1, -1, -1):
+                if self._containers[depth].tag == tag:
+                    for container in self._containers[depth:]:
+                        self._close_container(container)
+                    del self._containers[depth:]
+                    break
+
+        if tag in _HEADINGS or tag in _PARAGRAPH_TAGS:
+            self._break(2)
+        elif tag in _LINE_TAGS or tag in ("li", "ul", "ol"):
+            self._break(1)
+            if tag in ("ul", "ol") and self._lists:
+                self._lists.pop()
+        elif tag == "pre" and self._pre:
+            self._pre -= 1
+            self._break(1)
+            self._write("```")
+            self._break(2)
+        elif tag == "a":
+            self._end_link()
+        elif tag in _EMPHASIS and not self._pre:
+            self._write(_EMPHASIS[tag])
+
+        if tag == self._prune_tag:
+            self._prune_depth -= 1
+            if self._prune_depth == 0:
+                self._prune_tag = None
+                self._pruned[-1][1] = len(self._parts)
+
+    def handle_data(self, data: str) -> None:
+        if self._skip_tag is not None:
+            if self._title_parts is not None:
+                self._title_parts.append(data)
+            return
+
+        if self._pre:
+            self._write(data)
+            return
+
+        text = _WHITESPACE.sub(" ", data)
+        if self._newlines or not self._parts or self._parts[-1].endswith(("\n", " ")):
+            text = text.lstrip()
+
+        self._write(text)
+
+
+def _init_worker(memory_mb: int) -> None:
+    # the memory guard: a pathological page raises MemoryError inside the
+    # worker instead of growing until the container's OOM killer picks a victim
+    try:
+        import resource
+
+        limit = memory_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    except (ImportError, ValueError, OSError):
+        pass  # no rlimits on this platform; the job timeout still applies
+
+
+def _on_alarm(_signum, _frame):
+    raise TimeoutError
+
+
+def _convert_job(html: bytes, timeout: float) -> str:
+    """Worker entry point: html_to_markdown under a SIGALRM deadline.
+
+    The alarm interrupts the conversion inside the worker, so a slow page
+    costs its own job and nothing else — a ProcessPoolExecutor has no way to
+    cancel a job that is already running.
+    """
+    if not hasattr(signal, "SIGALRM"):
+        return html_to_markdown(html)
+
+    signal.signal(signal.SIGALRM, _on_alarm)
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        return html_to_markdown(html)
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+
+
+class HtmlConverter:
+    """Runs html_to_markdown off the event loop, in worker processes if enabled.
+
+    html.parser and markdownify are pure Python and hold the GIL, so
+    asyncio.to_thread still serialized concurrent conversions on one core and
+    took CPU from the gateway heartbeat. With HTML_CONVERT_WORKERS > 0 pages
+    are converted in a process pool instead; with 0 the old in-thread path is
+    used. Either way at most HTML_CONVERT_MAX_QUEUE jobs may be pending — past
+    that a fetch fails fast rather than queueing behind minutes of work — and
+    a fetch gives up on a conversion after HTML_CONVERT_TIMEOUT. Only worker
+    processes can actually stop a slow conversion and cap its memory; a
+    thread that timed out runs on, still counted as pending, until it ends.
+    """
+
+    def __init__(self, workers: int, max_pending: int):
+        self._workers = workers
+        self._max_pending = max_pending
+        self._pending = 0
+        self._pool: ProcessPoolExecutor | None = None
+
+    @property
+    def queue_depth(self) -> int:
+        """Jobs waiting for a worker, not counting the ones being converted."""
+        return max(0, self._pending - max(self._workers, 1))
+
+    def start(self) -> None:
+        if self._workers > 0 and self._pool is None:
+            self._pool = self._new_pool()
+
+    def stop(self) -> None:
+        pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def _new_pool(self) -> ProcessPoolExecutor:
+        # max_tasks_per_child makes the pool spawn (not fork) its workers,
+        # which also keeps them clear of the event loop's inherited state
+        return ProcessPoolExecutor(
+            max_workers=self._workers,
+            max_tasks_per_child=JOBS_PER_WORKER,
+            initializer=_init_worker,
+            initargs=(HTML_CONVERT_MEMORY_MB,),
+        )
+
+    async def convert(self, html: bytes) -> str:
+        if self._pending >= self._max_pending:
+            metrics.incr("html.convert.rejected")
+            raise HtmlConversionError("Page converter is busy; try again shortly.")
+
+        self._pending += 1
+        started = time.perf_counter()
+
+        try:
+            if self._pool is None:
+                return await self._convert_in_thread(html)
+
+            return await self._convert_in_pool(html)
+        finally:
+            self._pending -= 1
+            metrics.observe("html.convert.seconds", time.perf_counter() - started)
+
+    async def _convert_in_thread(self, html: bytes) -> str:
+        job = asyncio.ensure_future(asyncio.to_thread(html_to_markdown, html))
+
+        try:
+            return await asyncio.wait_for(asyncio.shield(job), HTML_CONVERT_TIMEOUT)
+        except asyncio.TimeoutError:
+            metrics.incr("html.convert.timeout")
+            # a thread can't be stopped, so the abandoned job keeps its place
+            # under the queue bound until it actually finishes
+            self._pending += 1
+            job.add_done_callback(self._abandoned_done)
+            raise HtmlConversionError("Page took too long to convert.") from None
+
+    def _abandoned_done(self, job: asyncio.Future) -> None:
+        self._pending -= 1
+        if not job.cancelled():
+            job.exception()  # nobody awaits it any more; don't log it as lost
+
+    async def _convert_in_pool(self, html: bytes) -> str:
+        pool = self._pool
+        job = asyncio.get_running_loop().run_in_executor(
+            pool, _convert_job, html, HTML_CONVERT_TIMEOUT
+        )
+
+        try:
+            return await asyncio.wait_for(job, HTML_CONVERT_TIMEOUT + TIMEOUT_GRACE)
+        except (TimeoutError, asyncio.TimeoutError):
+            metrics.incr("html.convert.timeout")
+            raise HtmlConversionError("Page took too long to convert.") from None
+        except MemoryError:
+            metrics.incr("html.convert.oom")
+            raise HtmlConversionError("Page too large to convert.") from None
+        except BrokenProcessPool:
+            # a worker died outright (killed, or crashed in C code), which
+            # poisons the whole pool — replace it so later fetches still work
+            metrics.incr("html.convert.pool_restart")
+            if self._pool is pool:
+                pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = self._new_pool()
+            raise HtmlConversionError("Page converter crashed on this page.") from None
+
+
+html_converter = HtmlConverter(HTML_CONVERT_WORKERS, HTML_CONVERT_MAX_QUEUE)
+metrics.gauge("html.convert.queue_depth", lambda: html_converter.queue_depth)
@@ -1,18 +1,74 @@
+import asyncio
 import base64
+from collections.abc import Awaitable, Callable
 
-from bot.utils.settings import OPENAI_IMAGE_MODEL
+from bot.utils.settings import (
+    IMAGINE_OUTPUT_COMPRESSION,
+    IMAGINE_OUTPUT_FORMAT,
+    IMAGINE_PARTIAL_IMAGES,
+    OPENAI_API_BASE_URL,
+    OPENAI_IMAGE_MODEL,
+)
 
-from .openai_client import client
+from .openai_client import client, openai_gate
+from .ratelimit import INTERACTIVE
 
+# output format, compression and partial images are OpenAI-only, like
+# prompt_cache_key: a compatible server may reject them, so it gets the plain
+# request and answers with its default, a png
+OUTPUT_FORMAT = IMAGINE_OUTPUT_FORMAT if OPENAI_API_BASE_URL is None else "png"
+IMAGE_FILENAME = "image." + {"jpeg": "jpg"}.get(OUTPUT_FORMAT, OUTPUT_FORMAT)
 
-async def generate_image(prompt: str) -> bytes:
-    response = await client.images.generate(
-        model=OPENAI_IMAGE_MODEL,
-        prompt=prompt,
-        n=1,
-        size="1024x1024",
-        moderation="low",
-    )
 
-    image_bytes = base64.b64decode(response.data[0].b64_json)
-    return image_bytes
+async def _decode(b64_json: str) -> bytes:
+    # a 1024x1024 image is megabytes of base64; decoding it on the event loop
+    # stalls every other command for the duration
+    return await asyncio.to_thread(base64.b64decode, b64_json)
+
+
+async def generate_image(
+    prompt: str, on_partial: Callable[[bytes], Awaitable[None]] | None = None
+) -> bytes:
+    """Generate an image and return it encoded as OUTPUT_FORMAT.
+
+    With `on_partial`, the image is streamed from OpenAI and `on_partial` is
+    awaited with each low-fidelity partial image as it arrives, before the
+    final one.
+    """
+    options = {
+        "model": OPENAI_IMAGE_MODEL,
+        "prompt": prompt,
+        "n": 1,
+        "size": "1024x1024",
+        "moderation": "low",
+    }
+    if OPENAI_API_BASE_URL is None:
+        options["output_format"] = OUTPUT_FORMAT
+        # a lossy format at this compression is a fraction of the PNG's size,
+        # and both the download and the Discord upload scale with it
+        if OUTPUT_FORMAT != "png":
+            options["output_compression"] = IMAGINE_OUTPUT_COMPRESSION
+
+    if (
+        on_partial is None
+        or IMAGINE_PARTIAL_IMAGES <= 0
+        or OPENAI_API_BASE_URL is not None
+    ):
+        response = await openai_gate.call(
+            lambda: client.images.generate(**options), priority=INTERACTIVE
+        )
+        return await _decode(response.data[0].b64_json)
+
+    async with openai_gate.stream(
+        lambda: client.images.generate(
+            **options, stream=True, partial_images=IMAGINE_PARTIAL_IMAGES
+        ),
+        priority=INTERACTIVE,
+    ) as stream:
+        async for event in stream:
+            if event.type == "image_generation.partial_image":
+                await on_partial(await _decode(event.b64_json))
+            elif event.type == "image_generation.completed":
+                return await _decode(event.b64_json)
+
+    raise RuntimeError("The image stream ended without a final image")
@@ -0,0 +1,74 @@
+import re
+from urllib.parse import parse_qsl, urlencode, urljoin, urlsplit, urlunsplit
+
+# query parameters that identify a campaign or a click, never the page itself
+TRACKING_PARAMS = re.compile(
+    r"^(utm_\w+|fbclid|gclid|gclsrc|dclid|msclkid|yclid|igshid|mc_cid|mc_eid|"
+    r"_hsenc|_hsmi|mkt_tok|oly_enc_id|oly_anon_id|vero_id|wickedid|"
+    r"ref_src|ref_url|spm|scid|cmpid|s_cid)$",
+    re.IGNORECASE,
+)
+
+# [text](url) and ![alt](url), with an optional "title". The URL may hold one
+# level of balanced parentheses, which Wikipedia article names often do
+_MARKDOWN_LINK = re.compile(
+    r"(?P<bang>!?)\[(?P<text>[^\]\n]*)\]"
+    r"\((?P<url>(?:[^()\s]|\([^()\s]*\))+)(?:\s+\"[^\"]*\")?\)"
+)
+
+
+def clean_url(url: str, base_url: str) -> str:
+    """Absolute form of `url`, with tracking parameters and fragment removed."""
+    absolute = urljoin(base_url, url)
+    parts = urlsplit(absolute)
+
+    if parts.scheme not in ("http", "https"):
+        return absolute  # mailto:, data:, tel: — nothing to clean
+
+    query = urlencode(
+        [
+            (name, value)
+            for name, value in parse_qsl(parts.query, keep_blank_values=True)
+            if not TRACKING_PARAMS.match(name)
+        ]
+    )
+
+    return urlunsplit((parts.scheme, parts.netloc, parts.path, query, ""))
+
+
+def compact_links(
+    markdown: str, base_url: str, max_chars: int, truncated: bool = False
+) -> str:
+    """Move link targets into a numbered reference table below the text.
+
+    Every inline link becomes `[text][n]`, with each distinct (cleaned,
+    absolute) URL getting a single `[n]: url` line no matter how often the
+    page repeats it. Long tracking-laden URLs then cost their characters once,
+    at the end, instead of inside every sentence that links them.
+
+    The text is truncated to `max_chars` *before* the table is added, and the
+    table lists only references the kept text still uses — numbers follow
+    first appearance, so those are always 1..n. `truncated` marks text that was
+    already cut short upstream, so it gets the truncation note even when the
+    compacted text now fits.
+    """
+    references: dict[str, int] = {}
+
+    def replace(match: re.Match) -> str:
+        url = clean_url(match["url"], base_url)
+        number = references.setdefault(url, len(references) + 1)
+
+        return f"{match['bang']}[{match['text']}][{number}]"
+
+    body = _MARKDOWN_LINK.sub(replace, markdown)
+
+    if truncated or len(body) > max_chars:
+        body = body[:max_chars] + "\n\n... [content truncated]"
+
+    used = {int(n) for n in re.findall(r"\]\[(\d+)\]", body)}
+    table = [f"[{n}]: {url}" for url, n in references.items() if n in used]
+
+    if not table:
+        return body
+
+    return body + "\n\n" + "\n".join(table)
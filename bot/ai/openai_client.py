@@ -1,8 +1,31 @@
-from openai import AsyncOpenAI
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+from bot.utils.settings import (
+    OPENAI_API_BASE_URL,
+    OPENAI_API_KEY,
+    OPENAI_MAX_CONCURRENCY,
+    OPENAI_MAX_RETRIES,
+)
+
+from .ratelimit import RateLimitGate
+
+# every call goes through the gate, which paces them against the rate limits
+# the responses report and does its own retrying — the SDK's retries would
+# sleep while holding a slot, blind to everyone else hitting the same 429s
+openai_gate = RateLimitGate(OPENAI_MAX_CONCURRENCY, OPENAI_MAX_RETRIES)
+
+
+async def _observe(response: httpx.Response) -> None:
+    openai_gate.observe(response)
 
-from bot.utils.settings import OPENAI_API_BASE_URL, OPENAI_API_KEY
 
 # module level on purpose: chat, image generation and web extraction all import
 # this one client so they share a connection pool. Constructing AsyncOpenAI per
 # call would mean a new pool and TLS handshake every time.
-client = AsyncOpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_API_BASE_URL)
+client = AsyncOpenAI(
+    api_key=OPENAI_API_KEY,
+    base_url=OPENAI_API_BASE_URL,
+    max_retries=0,
+    http_client=DefaultAsyncHttpxClient(event_hooks={"response": [_observe]}),
+)
@@ -0,0 +1,83 @@
+import discord
+
+from bot.utils.metrics import metrics
+from bot.utils.settings import ASK_CONTEXT_ONLINE_NAMES
+
+ONLINE_STATUSES = {discord.Status.online, discord.Status.idle, discord.Status.dnd}
+
+
+class PresenceIndex:
+    """Who is online in each guild, kept current from gateway events.
+
+    Building the "Online users" context line used to scan every member of the
+    guild on every /ask. The index is instead loaded once per guild when it
+    becomes ready and then adjusted one member at a time as presence and
+    membership events arrive; the line itself is cached per guild and only
+    rebuilt after something in it changed.
+    """
+
+    def __init__(self, max_names: int):
+        self._max_names = max_names
+        # guild id -> member id -> display name, online non-bot members only
+        self._online: dict[int, dict[int, str]] = {}
+        self._lines: dict[int, str] = {}
+
+    def load(self, guild: discord.Guild) -> None:
+        self._online[guild.id] = {
+            member.id: member.display_name
+            for member in guild.members
+            if not member.bot and member.status in ONLINE_STATUSES
+        }
+        self._lines.pop(guild.id, None)
+        metrics.incr("presence.load")
+
+    def forget(self, guild: discord.Guild) -> None:
+        self._online.pop(guild.id, None)
+        self._lines.pop(guild.id, None)
+
+    def update(self, member: discord.Member) -> None:
+        online = self._online.get(member.guild.id)
+        if online is None:
+            return  # loaded in full once the guild is ready
+
+        if not member.bot and member.status in ONLINE_STATUSES:
+            changed = online.get(member.id) != member.display_name
+            online[member.id] = member.display_name
+        else:
+            changed = online.pop(member.id, None) is not None
+
+        if changed:
+            self._lines.pop(member.guild.id, None)
+
+    def remove(self, member: discord.Member) -> None:
+        online = self._online.get(member.guild.id)
+
+        if online is not None and online.pop(member.id, None) is not None:
+            self._lines.pop(member.guild.id, None)
+
+    def line(self, guild: discord.Guild) -> str:
+        """The "Online users" context line for `guild`, or "" if nobody is."""
+        cached = self._lines.get(guild.id)
+        if cached is not None:
+            return cached
+
+        if guild.id not in self._online:
+            self.load(guild)
+
+        names = sorted(self._online[guild.id].values(), key=str.casefold)
+        shown = names[: self._max_names]
+
+        line = ""
+        if shown:
+            line = f"Online users: {', '.join(shown)}"
+            if len(names) > len(shown):
+                line += f" and {len(names) - len(shown)} more"
+            line += "\n\n"
+
+        self._lines[guild.id] = line
+        metrics.incr("presence.line.rebuild")
+
+        return line
+
+
+presence_index = PresenceIndex(ASK_CONTEXT_ONLINE_NAMES)
@@ -0,0 +1,304 @@
+import asyncio
+import heapq
+import itertools
+import random
+import re
+import time
+from collections.abc import AsyncIterator, Awaitable, Callable
+from contextlib import AbstractAsyncContextManager, asynccontextmanager
+from typing import TypeVar
+
+import httpx
+import openai
+
+from bot.utils.metrics import metrics
+
+T = TypeVar("T")
+# a streamed response, closed when its block exits
+S = TypeVar("S", bound=AbstractAsyncContextManager)
+
+# lower runs first: a user waiting on /ask or /imagine beats a helper call
+INTERACTIVE = 0
+BACKGROUND = 1
+
+# budget held back for interactive calls once the provider says we are close
+# to the limit, so helper calls can't spend the last of it
+INTERACTIVE_RESERVE_REQUESTS = 2
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 30.0
+# a burst of 429s is one signal, not many: halve the limit at most this often
+DECREASE_COOLDOWN = 1.0
+
+_RETRYABLE = (
+    openai.RateLimitError,
+    openai.InternalServerError,
+    openai.APIConnectionError,  # includes APITimeoutError
+)
+_DURATION_PART = re.compile(r"([\d.]+)(ms|s|m|h)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def _parse_duration(value: str | None) -> float | None:
+    """Seconds in an x-ratelimit-reset-* value such as "6m0s" or "20ms"."""
+    if not value:
+        return None
+
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        return None
+
+    try:
+        return sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in parts)
+    except ValueError:  # "1.2.3s"
+        return None
+
+
+def _remaining(headers: httpx.Headers, name: str) -> int | None:
+    # a compatible server or a proxy may send anything here, and this runs in
+    # the response hook, where raising would fail the request itself
+    try:
+        return int(headers[name])
+    except (KeyError, ValueError):
+        return None
+
+
+def _retry_after(headers: httpx.Headers) -> float | None:
+    for name, scale in (("retry-after-ms", 0.001), ("retry-after", 1.0)):
+        try:
+            return float(headers[name]) * scale
+        except (KeyError, ValueError):
+            continue
+
+    return None
+
+
+class RateLimitGate:
+    """Paces OpenAI calls to stay under the account's rate limits.
+
+    Every response's x-ratelimit-* headers update what is left of the request
+    and token budgets. When they run low, calls wait for the reset instead of
+    being sent into a 429. On top of that the number of calls in flight is
+    capped by an AIMD limit — it grows by one per limit's worth of successes
+    and halves on a 429 — so the bot settles just under whatever the provider
+    tolerates. A 429 also pauses everyone for the server's retry-after.
+
+    Waiting calls are admitted by priority, interactive first, and only
+    interactive calls may use the last few requests of a nearly spent budget.
+    """
+
+    def __init__(self, max_concurrency: int, max_retries: int):
+        self._max_limit = max_concurrency
+        self._limit = float(max_concurrency)
+        self._max_retries = max_retries
+        self._in_flight = 0
+        # (priority, arrival, future, tokens): a heap, best priority first
+        self._waiters: list[tuple[int, int, asyncio.Future, int]] = []
+        self._order = itertools.count()
+        self._timer: asyncio.TimerHandle | None = None
+        self._last_decrease = 0.0
+
+        self._paused_until = 0.0
+        self._remaining_requests: int | None = None
+        self._remaining_tokens: int | None = None
+        self._requests_reset_at = 0.0
+        self._tokens_reset_at = 0.0
+
+        metrics.gauge("openai.limit", lambda: round(self._limit, 1))
+        metrics.gauge("openai.in_flight", lambda: self._in_flight)
+        metrics.gauge("openai.waiting", lambda: len(self._waiters))
+
+    def observe(self, response: httpx.Response) -> None:
+        """Learn the remaining budget from a response; used as an httpx hook."""
+        headers = response.headers
+        now = time.monotonic()
+
+        remaining = _remaining(headers, "x-ratelimit-remaining-requests")
+        if remaining is not None:
+            self._remaining_requests = remaining
+            reset = _parse_duration(headers.get("x-ratelimit-reset-requests"))
+            self._requests_reset_at = now + (reset or 1.0)
+
+        remaining = _remaining(headers, "x-ratelimit-remaining-tokens")
+        if remaining is not None:
+            self._remaining_tokens = remaining
+            reset = _parse_duration(headers.get("x-ratelimit-reset-tokens"))
+            self._tokens_reset_at = now + (reset or 1.0)
+
+        if response.status_code == 429:
+            delay = _retry_after(headers) or RETRY_BASE_DELAY
+            self._paused_until = max(self._paused_until, now + delay)
+
+    async def call(
+        self,
+        make_call: Callable[[], Awaitable[T]],
+        priority: int = BACKGROUND,
+        tokens: int = 0,
+    ) -> T:
+        """Run `make_call` once admitted, retrying rate limits and server errors.
+
+        `tokens` is the caller's estimate of the request's size, checked
+        against the remaining token budget before it is sent.
+        """
+        result = await self._send(make_call, priority, tokens)
+        self._release(success=True, limited=False)
+        return result
+
+    @asynccontextmanager
+    async def stream(
+        self,
+        make_call: Callable[[], Awaitable[S]],
+        priority: int = BACKGROUND,
+        tokens: int = 0,
+    ) -> AsyncIterator[S]:
+        """call() for a streamed response, holding its slot until the block exits.
+
+        The response headers, and with them the stream, arrive long before the
+        generation ends, so the call stays in flight while it is read. The
+        stream is closed on the way out, also when the reader stops early.
+        """
+        stream = await self._send(make_call, priority, tokens)
+        success = False
+
+        try:
+            async with stream:
+                yield stream
+            success = True
+        finally:
+            self._release(success=success, limited=False)
+
+    async def _send(
+        self, make_call: Callable[[], Awaitable[T]], priority: int, tokens: int
+    ) -> T:
+        """Retry loop behind call() and stream(); returns still holding a slot."""
+        for attempt in range(self._max_retries + 1):
+            await self._acquire(priority, tokens)
+            try:
+                return await make_call()
+            except _RETRYABLE as e:
+                self._release(
+                    success=False, limited=isinstance(e, openai.RateLimitError)
+                )
+                if attempt == self._max_retries:
+                    raise
+
+                delay = self._backoff(e, attempt)
+                metrics.incr("openai.retry")
+                print(
+                    f"OpenAI call failed ({e.__class__.__name__}), retry in {delay:.1f}s"
+                )
+                await asyncio.sleep(delay)
+            except BaseException:
+                self._release(success=False, limited=False)
+                raise
+
+        raise AssertionError("unreachable")
+
+    def _backoff(self, error: Exception, attempt: int) -> float:
+        response = getattr(error, "response", None)
+        server_delay = _retry_after(response.headers) if response is not None else None
+
+        if server_delay is not None:
+            return min(server_delay, RETRY_MAX_DELAY)
+
+        # full jitter, so callers that failed together don't retry together
+        return random.uniform(0, min(RETRY_BASE_DELAY * 2**attempt, RETRY_MAX_DELAY))
+
+    async def _acquire(self, priority: int, tokens: int) -> None:
+        if not self._waiters and self._admissible(priority, tokens) == 0:
+            self._admit(tokens)
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        entry = (priority, next(self._order), future, tokens)
+        heapq.heappush(self._waiters, entry)
+        metrics.incr("openai.throttled")
+        started = time.monotonic()
+
+        try:
+            self._dispatch()
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self._release(success=False, limited=False)  # admitted meanwhile
+            elif entry in self._waiters:
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+            raise
+        finally:
+            metrics.observe("openai.throttle_wait", time.monotonic() - started)
+
+    def _admissible(self, priority: int, tokens: int) -> float:
+        """0 if a call may start now, else seconds until that could change.
+
+        A full concurrency limit returns infinity: only a release changes it.
+        """
+        now = time.monotonic()
+
+        if now < self._paused_until:
+            return self._paused_until - now
+
+        if self._in_flight >= int(self._limit):
+            return float("inf")
+
+        reserve = INTERACTIVE_RESERVE_REQUESTS if priority != INTERACTIVE else 0
+        if (
+            self._remaining_requests is not None
+            and self._remaining_requests <= reserve
+            and now < self._requests_reset_at
+        ):
+            return self._requests_reset_at - now
+
+        if (
+            self._remaining_tokens is not None
+            and self._remaining_tokens < tokens
+            and now < self._tokens_reset_at
+        ):
+            return self._tokens_reset_at - now
+
+        return 0
+
+    def _admit(self, tokens: int) -> None:
+        self._in_flight += 1
+
+        # spend the budget locally until the next response reports it exactly
+        if self._remaining_requests is not None:
+            self._remaining_requests -= 1
+        if self._remaining_tokens is not None:
+            self._remaining_tokens -= tokens
+
+    def _release(self, success: bool, limited: bool) -> None:
+        self._in_flight -= 1
+        now = time.monotonic()
+
+        if success:
+            self._limit = min(self._limit + 1 / self._limit, self._max_limit)
+        elif limited and now - self._last_decrease >= DECREASE_COOLDOWN:
+            self._limit = max(self._limit / 2, 1.0)
+            self._last_decrease = now
+            metrics.incr("openai.limit.decrease")
+
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        while self._waiters:
+            priority, _, future, tokens = self._waiters[0]
+
+            if future.cancelled():
+                heapq.heappop(self._waiters)
+                continue
+
+            wait = self._admissible(priority, tokens)
+            if wait:
+                # a time-based block lifts without any release to trigger us
+                if wait != float("inf"):
+                    loop = asyncio.get_running_loop()
+                    self._timer = loop.call_later(wait, self._dispatch)
+                return
+
+            heapq.heappop(self._waiters)
+            self._admit(tokens)
+            future.set_result(None)
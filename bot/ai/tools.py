@@ -5,25 +5,59 @@ from typing import Optional
 
 import discord
 import httpx
-from bs4 import BeautifulSoup
-from markdownify import MarkdownConverter
 from openai import pydantic_function_tool
 from pydantic import BaseModel, Field
 
-from bot.ai.chat import run_web_extraction
+from bot.ai.budget import CHARS_PER_TOKEN, SEARCH_RESULTS_CLOSE, SEARCH_RESULTS_OPEN
+from bot.ai.chat import run_map_reduce_extraction, run_web_extraction
+from bot.ai.fetch_cache import fetch_cache, normalize_url
+from bot.ai.html import HtmlConversionError, StreamingMarkdownConverter, html_converter
+from bot.ai.links import compact_links
+from bot.utils.cache import SingleFlight, TTLCache
+from bot.utils.http import http_clients
+from bot.utils.metrics import metrics
 from bot.utils.net import UnsafeUrlError, assert_public_url
-from bot.utils.settings import DGPT_SEARCH_URL, EVENTS_VOICE_CHANNEL_ID, OPENAI_API_KEY
-
-MAX_FETCH_CHARS = 50_000  # markdown handed to the helper model
+from bot.utils.settings import (
+    DGPT_SEARCH_URL,
+    EVENTS_VOICE_CHANNEL_ID,
+    OPENAI_API_KEY,
+    WEB_FETCH_MAP_REDUCE,
+    WEB_FETCH_PREFETCH_RESULTS,
+    WEB_FETCH_STREAM_PARSE,
+    WEB_SEARCH_CACHE_TTL,
+)
+
+MAX_FETCH_CHARS = 50_000  # markdown handed to one helper-model call
+# ceiling on page tokens read across all parts of one fetch. Map-reduce
+# extraction reads a long page in MAX_FETCH_CHARS-sized parts instead of
+# truncating it to the first one, and this much markdown is what is fetched
+# for it — no more, so nothing downloaded and converted goes unread
+MAP_REDUCE_MAX_TOKENS = 60_000
+MAP_REDUCE_MAX_CHARS = MAP_REDUCE_MAX_TOKENS * CHARS_PER_TOKEN
+MAP_REDUCE_OVERLAP_CHARS = 1_500  # so a fact straddling a cut is seen whole
+MAP_REDUCE_CONCURRENCY = 4
+FETCH_CHAR_BUDGET = MAP_REDUCE_MAX_CHARS if WEB_FETCH_MAP_REDUCE else MAX_FETCH_CHARS
 # hard body cap so a huge page can't exhaust memory. Everything past
-# MAX_FETCH_CHARS of markdown is discarded anyway, so parsing more than this
+# FETCH_CHAR_BUDGET of markdown is discarded anyway, so parsing more than this
 # only buys parse time
 MAX_FETCH_BYTES = 2_000_000
 MAX_REDIRECTS = 5
-WEB_FETCH_TIMEOUT = 15.0
 WEB_FETCH_USER_AGENT = "Mozilla/5.0 (compatible; elongpt-bot/1.0)"
 WEB_FETCH_ACCEPT = "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8"
 FALLBACK_EXCERPT_CHARS = 8_000
+SEARCH_CACHE_ENTRIES = 256
+# speculative fetches of search results. The concurrency cap is shared by all
+# interactions, so prefetching never crowds out the fetches the model asked for
+PREFETCH_CONCURRENCY = 4
+# per interaction, reserved before each fetch; a page the remainder cuts short
+# isn't kept
+PREFETCH_MAX_CHARS = 600_000
+
+_search_cache: TTLCache[str] = TTLCache(SEARCH_CACHE_ENTRIES, WEB_SEARCH_CACHE_TTL)
+_prefetch_slots = asyncio.Semaphore(PREFETCH_CONCURRENCY)
+_search_flights: SingleFlight[str] = SingleFlight()
+metrics.gauge("websearch.cache.entries", lambda: len(_search_cache))
+metrics.gauge("websearch.inflight", lambda: len(_search_flights))
 
 
 class CreateScheduledEvent(BaseModel):
@@ -95,7 +129,9 @@ if EVENTS_VOICE_CHANNEL_ID is not None:
 
 
 async def handle_create_scheduled_event(
-    args: CreateScheduledEvent, guild: discord.Guild | None
+    args: CreateScheduledEvent,
+    guild: discord.Guild | None,
+    _prefetch: "Prefetcher | None",
 ) -> str:
     if guild is None:
         return json.dumps(
@@ -137,7 +173,11 @@ async def handle_create_scheduled_event(
         return json.dumps({"error": str(e)})
 
 
-async def handle_web_search(args: WebSearch, _guild: discord.Guild | None) -> str:
+def _search_key(args: WebSearch) -> tuple[str, int]:
+    return " ".join(args.query.casefold().split()), args.count
+
+
+async def _run_web_search(args: WebSearch) -> str:
     payload_body = {"query": args.query, "count": args.count}
 
     headers = {
@@ -146,25 +186,129 @@ async def handle_web_search(args: WebSearch, _guild: discord.Guild | None) -> st
         "Authorization": f"Bearer {OPENAI_API_KEY}",
     }
 
+    response = await http_clients.search.post(
+        DGPT_SEARCH_URL, json=payload_body, headers=headers
+    )
+    response.raise_for_status()
+    data = response.json()
+
+    results = [
+        {
+            "title": r.get("title"),
+            "url": r.get("url"),
+            "description": r.get("description"),
+            "age": r.get("age"),
+        }
+        for r in data.get("data", [])
+    ]
+    payload = json.dumps({"query": args.query, "results": results})
+    result = f"{SEARCH_RESULTS_OPEN}{payload}{SEARCH_RESULTS_CLOSE}"
+
+    # stored by the one call that actually ran, not by each coalesced waiter
+    _search_cache.set(_search_key(args), result)
+    return result
+
+
+class Prefetcher:
+    """Speculative WebFetches of the top search results for one /ask.
+
+    After a search the model nearly always fetches one of the first results,
+    but only after another full model round trip. The prefetcher starts those
+    fetches as soon as the search returns; handle_web_fetch then takes a page
+    from here instead of starting from scratch. Fetches go through
+    _fetch_page, so every hop passes assert_public_url like any other.
+
+    Owned by the interaction: close() cancels whatever was never used.
+    """
+
+    def __init__(self, max_chars: int = PREFETCH_MAX_CHARS):
+        self._pages: dict[str, asyncio.Task[tuple[str, str, bool] | None]] = {}
+        self._chars_left = max_chars
+
+    def start(self, urls: list[str]) -> None:
+        for url in urls[:WEB_FETCH_PREFETCH_RESULTS]:
+            key = normalize_url(url)
+            if key not in self._pages:
+                task = asyncio.create_task(self._fetch(url))
+                # a failure is only interesting if the model asks for the page,
+                # and then it is fetched and reported again
+                task.add_done_callback(lambda t: t.cancelled() or t.exception())
+                self._pages[key] = task
+                metrics.incr("webfetch.prefetch.started")
+
+    def take(self, url: str) -> asyncio.Task[tuple[str, str, bool] | None] | None:
+        return self._pages.pop(normalize_url(url), None)
+
+    def close(self) -> None:
+        pages, self._pages = self._pages, {}
+        for task in pages.values():
+            task.cancel()
+
+        metrics.incr("webfetch.prefetch.unused", len(pages))
+
+    async def _fetch(self, url: str) -> tuple[str, str, bool] | None:
+        async with _prefetch_slots:
+            # what is left becomes the page's budget, so the cap bounds the
+            # speculative download and conversion, not just what is kept
+            budget = min(self._chars_left, FETCH_CHAR_BUDGET)
+            if budget <= 0:
+                metrics.incr("webfetch.prefetch.over_budget")
+                return None
+
+            # held while fetching, so concurrent prefetches can't each count
+            # on the same remainder, then settled against the page's size
+            self._chars_left -= budget
+            try:
+                page = await _fetch_page(url, budget)
+            finally:
+                self._chars_left += budget
+
+        _, content, truncated = page
+        # a page cut short by the remainder isn't what the model would get;
+        # it is fetched for real if asked for
+        if len(content) > self._chars_left or (
+            truncated and budget < FETCH_CHAR_BUDGET
+        ):
+            metrics.incr("webfetch.prefetch.over_budget")
+            return None
+
+        self._chars_left -= len(content)
+        return page
+
+
+def _result_urls(result: str) -> list[str]:
+    payload = result.removeprefix(SEARCH_RESULTS_OPEN).removesuffix(
+        SEARCH_RESULTS_CLOSE
+    )
+    return [r["url"] for r in json.loads(payload)["results"] if r.get("url")]
+
+
+async def handle_web_search(
+    args: WebSearch, _guild: discord.Guild | None, prefetch: Prefetcher | None
+) -> str:
+    """Run a web search, reusing a recent identical one where possible.
+
+    A trending topic brings the same query from several users within a minute,
+    sometimes inside one tool round. Results are cached for
+    WEB_SEARCH_CACHE_TTL, and identical searches that overlap share a single
+    request to the search API. Errors are never cached.
+    """
+    key = _search_key(args)
+    result = _search_cache.get(key)
+
     try:
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.post(
-                DGPT_SEARCH_URL, json=payload_body, headers=headers
+        if result is not None:
+            metrics.incr("websearch.cache.hit")
+        else:
+            result, shared = await _search_flights.do(
+                key, lambda: _run_web_search(args)
             )
-            response.raise_for_status()
-            data = response.json()
-
-        results = [
-            {
-                "title": r.get("title"),
-                "url": r.get("url"),
-                "description": r.get("description"),
-                "age": r.get("age"),
-            }
-            for r in data.get("data", [])
-        ]
-        payload = json.dumps({"query": args.query, "results": results})
-        return f"<search_results>{payload}</search_results>"
+            metrics.incr("websearch.coalesced" if shared else "websearch.cache.miss")
+
+        if prefetch is not None:
+            prefetch.start(_result_urls(result))
+
+        return result
     except httpx.HTTPStatusError as e:
         return json.dumps(
             {"error": f"Web search returned HTTP {e.response.status_code}"}
@@ -173,117 +317,205 @@ async def handle_web_search(args: WebSearch, _guild: discord.Guild | None) -> st
         return json.dumps({"error": str(e)})
 
 
-# Dropped before conversion. script/style/noscript/template because
-# markdownify's `strip` option keeps their inner text (inline JS/CSS leaks in);
-# nav/footer/aside/form because chrome otherwise eats the MAX_FETCH_CHARS budget
-# ahead of the article. `header` is left in — it often carries the title/byline.
-NON_CONTENT_TAGS = [
-    "script",
-    "style",
-    "noscript",
-    "template",
-    "nav",
-    "footer",
-    "aside",
-    "form",
-]
-
+async def _read_capped(response: httpx.Response) -> tuple[bytes, bool]:
+    """Read a streamed body, stopping once MAX_FETCH_BYTES have arrived.
 
-def _html_to_markdown(html: bytes) -> str:
-    """Convert a page body to Markdown. Blocking — call it via asyncio.to_thread.
-
-    Takes bytes rather than str so BeautifulSoup can sniff the encoding itself:
-    plenty of pages declare their charset only in <meta charset=...>, and
-    decoding those as UTF-8 up front turns them into mojibake the extraction
-    model then reads as fact.
+    Returns the body and whether it was cut short there.
     """
-    soup = BeautifulSoup(html, "html.parser")
-    for tag in soup(NON_CONTENT_TAGS):
-        tag.decompose()
-
-    # convert_soup, not markdownify(str(soup)): the latter re-serializes the
-    # whole tree and markdownify parses it a second time, doubling the work
-    return MarkdownConverter().convert_soup(soup)
-
-
-async def _read_capped(response: httpx.Response) -> bytes:
-    """Read a streamed body, stopping once MAX_FETCH_BYTES have arrived."""
     chunks: list[bytes] = []
     total = 0
 
     async for chunk in response.aiter_bytes():
         remaining = MAX_FETCH_BYTES - total
-        if len(chunk) >= remaining:
+        if len(chunk) > remaining:
             chunks.append(chunk[:remaining])
-            break
+            return b"".join(chunks), True
 
         chunks.append(chunk)
         total += len(chunk)
 
-    return b"".join(chunks)
+    return b"".join(chunks), False
+
+
+async def _stream_markdown(response: httpx.Response, budget: int) -> tuple[str, bool]:
+    """Convert an HTML body to Markdown while it downloads.
+
+    Returns the Markdown and whether the page was cut short.
+
+    Stops reading once the converter has `budget` chars of Markdown — the
+    rest would be truncated anyway — so a huge page costs roughly the budget in
+    transfer, memory and parse time rather than up to MAX_FETCH_BYTES of each.
+    Parsing runs on the loop between chunks; the converter is a single linear
+    pass with no tree, and each feed is bounded by one network chunk.
+    """
+    converter = StreamingMarkdownConverter(
+        budget=budget, charset=response.charset_encoding
+    )
+    total = 0
+    capped = False
+
+    async for chunk in response.aiter_bytes():
+        converter.feed_bytes(chunk[: MAX_FETCH_BYTES - total])
+        total += len(chunk)
+        capped = total > MAX_FETCH_BYTES
+
+        if converter.done or total >= MAX_FETCH_BYTES:
+            metrics.incr("webfetch.stream.stopped_early")
+            break
+
+    metrics.observe("webfetch.stream.bytes_read", min(total, MAX_FETCH_BYTES))
+    markdown = converter.finish()
+
+    return markdown, converter.truncated or capped
+
 
+async def _fetch_page(
+    url: str, budget: int = FETCH_CHAR_BUDGET
+) -> tuple[str, str, bool]:
+    """Fetch a URL and return (final_url, page text as Markdown, truncated).
 
-async def _fetch_page(url: str) -> tuple[str, str]:
-    """Fetch a URL and return (final_url, page text as Markdown).
+    `truncated` is set when the page went on past what was read or converted.
+    A streamed HTML page stops at `budget` chars of Markdown.
 
     Redirects are followed by hand so every hop is re-validated. httpx's own
     redirect handling is off on purpose: it would only check the URL the model
     gave us, letting a public host 302 into the private network or at the cloud
     metadata endpoint.
+
+    Each hop consults fetch_cache first. A fresh entry is returned without any
+    request; a stale one with validators turns the GET conditional, and a 304
+    hands back the stored text without downloading or converting anything.
     """
     headers = {"User-Agent": WEB_FETCH_USER_AGENT, "Accept": WEB_FETCH_ACCEPT}
+    client = http_clients.web
     current = url
 
-    async with httpx.AsyncClient(
-        timeout=WEB_FETCH_TIMEOUT, follow_redirects=False, headers=headers
-    ) as client:
-        for _ in range(MAX_REDIRECTS + 1):
-            await assert_public_url(current)
-
-            # the model picks the whole URL, query string included, so this is
-            # the only record of what the bot sent where. Redirect hops land
-            # here too, since each one goes through this loop
-            print(f"WebFetch: GET {current}")
-
-            async with client.stream("GET", current) as response:
-                if response.has_redirect_location:
-                    current = str(response.next_request.url)
-                    continue
-
-                response.raise_for_status()
-                content_type = response.headers.get("content-type", "").lower()
-                is_html = "html" in content_type
-
-                if not is_html and not (
-                    content_type.startswith("text/") or "json" in content_type
-                ):
-                    raise _FetchError(
-                        f"Unsupported content type: {content_type or 'unknown'}"
-                    )
-
-                body = await _read_capped(response)
-                final_url = str(response.url)
-                charset = response.charset_encoding
-
-            # converted after the connection is released. html.parser is pure
-            # Python and markdownify walks the whole tree, so on a large page
-            # this is hundreds of ms of CPU — enough to stall the gateway
-            # heartbeat and every other command with it if left on the loop
-            if is_html:
-                return final_url, await asyncio.to_thread(_html_to_markdown, body)
+    for _ in range(MAX_REDIRECTS + 1):
+        cached = fetch_cache.lookup(current)
+        if cached is not None and cached.is_fresh():
+            metrics.incr("webfetch.cache.hit")
+            return cached.final_url, cached.content, cached.truncated
+
+        await assert_public_url(current)
+
+        # the model picks the whole URL, query string included, so this is
+        # the only record of what the bot sent where. Redirect hops land
+        # here too, since each one goes through this loop
+        print(f"WebFetch: GET {current}")
+
+        request_headers = headers | (cached.validators() if cached else {})
+
+        async with client.stream("GET", current, headers=request_headers) as response:
+            if response.has_redirect_location:
+                current = str(response.next_request.url)
+                continue
+
+            if cached is not None and response.status_code == 304:
+                metrics.incr("webfetch.cache.revalidated")
+                fetch_cache.refresh(current, response.headers)
+                return cached.final_url, cached.content, cached.truncated
 
+            metrics.incr("webfetch.cache.miss")
+            response.raise_for_status()
+            content_type = response.headers.get("content-type", "").lower()
+            is_html = "html" in content_type
+
+            if not is_html and not (
+                content_type.startswith("text/") or "json" in content_type
+            ):
+                raise _FetchError(
+                    f"Unsupported content type: {content_type or 'unknown'}"
+                )
+
+            final_url = str(response.url)
+            charset = response.charset_encoding
+            content = None
+
+            if is_html and WEB_FETCH_STREAM_PARSE:
+                content, truncated = await _stream_markdown(response, budget)
+            else:
+                body, truncated = await _read_capped(response)
+
+        # otherwise converted after the connection is released. html.parser is
+        # pure Python and markdownify walks the whole tree, so on a large page
+        # this is hundreds of ms of CPU — enough to stall the gateway
+        # heartbeat and every other command with it if left on the loop
+        if content is None and is_html:
+            content = await html_converter.convert(body)
+        elif content is None:
             # non-HTML has no <meta charset> to sniff, so the header is all we get
-            return final_url, body.decode(charset or "utf-8", errors="replace")
+            content = body.decode(charset or "utf-8", errors="replace")
+
+        # a page cut at a smaller budget than usual would shortchange the
+        # next fetch of it
+        if budget >= FETCH_CHAR_BUDGET or not truncated:
+            fetch_cache.store(final_url, content, response.headers, truncated)
+        return final_url, content, truncated
 
     raise _FetchError("Too many redirects.")
 
 
-async def handle_web_fetch(args: WebFetch, _guild: discord.Guild | None) -> str:
+def _split_for_map_reduce(content: str, truncated: bool) -> list[tuple[str, bool]]:
+    """Cut `content` into overlapping parts for map-reduce extraction.
+
+    Parts are MAX_FETCH_CHARS long, cut at a paragraph break in their second
+    half where there is one, and each starts MAP_REDUCE_OVERLAP_CHARS before
+    the previous one ended. Text past MAP_REDUCE_MAX_CHARS — possible when
+    the page was converted whole rather than streamed to the budget — is
+    dropped, and counts as the page continuing; the overlaps come on top.
+    Returns (part, is_cut_short) pairs, the flag set only on a final part
+    whose page continued beyond it.
+    """
+    if len(content) > MAP_REDUCE_MAX_CHARS:
+        metrics.incr("webfetch.mapreduce.ceiling_hit")
+        content = content[:MAP_REDUCE_MAX_CHARS]
+        truncated = True
+
+    parts = []
+    start = 0
+
+    while start < len(content):
+        end = min(start + MAX_FETCH_CHARS, len(content))
+
+        if end < len(content):
+            cut = content.rfind("\n\n", start + MAX_FETCH_CHARS // 2, end)
+            end = cut if cut != -1 else end
+
+        parts.append(content[start:end])
+        if end == len(content):
+            break
+
+        start = end - MAP_REDUCE_OVERLAP_CHARS
+
+    return [(part, truncated and i == len(parts) - 1) for i, part in enumerate(parts)]
+
+
+async def _fetch_page_prefetched(
+    url: str, prefetch: Prefetcher | None
+) -> tuple[str, str, bool]:
+    task = prefetch.take(url) if prefetch is not None else None
+
+    if task is not None:
+        try:
+            page = await task
+        except Exception:
+            page = None  # fetched again below, so the error is reported as usual
+
+        if page is not None:
+            metrics.incr("webfetch.prefetch.hit")
+            return page
+
+    return await _fetch_page(url)
+
+
+async def handle_web_fetch(
+    args: WebFetch, _guild: discord.Guild | None, prefetch: Prefetcher | None
+) -> str:
     url = args.url.strip()
 
     try:
-        final_url, content = await _fetch_page(url)
-    except (UnsafeUrlError, _FetchError) as e:
+        final_url, content, truncated = await _fetch_page_prefetched(url, prefetch)
+    except (UnsafeUrlError, _FetchError, HtmlConversionError) as e:
         return json.dumps({"error": str(e), "url": url})
     except httpx.HTTPStatusError as e:
         return json.dumps(
@@ -298,16 +530,41 @@ async def handle_web_fetch(args: WebFetch, _guild: discord.Guild | None) -> str:
             {"error": "Fetched page had no readable content.", "url": url}
         )
 
-    if len(content) > MAX_FETCH_CHARS:
-        content = content[:MAX_FETCH_CHARS] + "\n\n... [content truncated]"
+    # `truncated` comes from the fetch itself: main-content selection and
+    # compaction can bring a cut-short page back well under the budget
+    raw_chars = len(content)
+
+    if WEB_FETCH_MAP_REDUCE and raw_chars > MAX_FETCH_CHARS:
+        parts = _split_for_map_reduce(content, truncated)
+        # each part gets its own reference table, numbered from 1
+        parts = [
+            compact_links(part, final_url, MAX_FETCH_CHARS, truncated=last)
+            for part, last in parts
+        ]
+        compacted_chars = sum(len(part) for part in parts)
+        excerpt = parts[0]
+        extraction = run_map_reduce_extraction(
+            args.prompt, parts, MAP_REDUCE_CONCURRENCY
+        )
+    else:
+        content = compact_links(
+            content, final_url, MAX_FETCH_CHARS, truncated=truncated
+        )
+        compacted_chars = len(content)
+        excerpt = content
+        extraction = run_web_extraction(args.prompt, content)
+
+    metrics.observe("webfetch.chars.raw", raw_chars)
+    metrics.observe("webfetch.chars.compacted", compacted_chars)
+    print(f"WebFetch: {final_url} {raw_chars} -> {compacted_chars} chars")
 
     try:
-        result = await run_web_extraction(args.prompt, content)
+        result = await extraction
     except Exception as e:
         # the helper model is a nice-to-have — hand back a raw excerpt rather
         # than throwing away a page we already paid to fetch
         print(f"Web extraction failed, returning raw excerpt: {e}")
-        result = content[:FALLBACK_EXCERPT_CHARS]
+        result = excerpt[:FALLBACK_EXCERPT_CHARS]
 
     return json.dumps({"url": url, "final_url": final_url, "result": result})
 
@@ -320,7 +577,10 @@ TOOL_HANDLERS = {
 
 
 async def execute_tool_call(
-    tool_name: str, arguments_json: str, guild: discord.Guild | None
+    tool_name: str,
+    arguments_json: str,
+    guild: discord.Guild | None,
+    prefetch: Prefetcher | None = None,
 ) -> str:
     handler_entry = TOOL_HANDLERS.get(tool_name)
     if not handler_entry:
@@ -329,6 +589,6 @@ async def execute_tool_call(
     model_cls, handler_fn = handler_entry
     try:
         args = model_cls.model_validate_json(arguments_json)
-        return await handler_fn(args, guild)
+        return await handler_fn(args, guild, prefetch)
     except Exception as e:
         return json.dumps({"error": str(e)})
@@ -1,23 +1,156 @@
 import asyncio
-import io
+import re
+import signal
+import time
 
 import discord
-import httpx
 from discord.ext import commands
 from discord.ui import Button, View
 
-from .ai.chat import get_chat_completion, get_chat_context
-from .ai.image import generate_image
-from .ai.tools import TOOL_DEFINITIONS, execute_tool_call
-from .db.completion import db_insert_completion
-from .utils import create_embed, image_to_base64, split_message
-from .utils.settings import ADMIN_USER_ID, CMC_API_KEY
+from .ai.answer_cache import CachedAnswer, answer_cache, answer_cache_key
+from .ai.attachments import ingest_images
+from .ai.chat import (
+    Conversation,
+    get_chat_completion,
+    get_chat_context,
+    stream_chat_completion,
+)
+from .ai.coalesce import ask_coalescer, coalesce_key
+from .ai.history import channel_history
+from .ai.html import html_converter
+from .ai.image import IMAGE_FILENAME, generate_image
+from .ai.presence import presence_index
+from .ai.tools import TOOL_DEFINITIONS, Prefetcher, execute_tool_call
+from .db.completion import completion_log, db_insert_completion
+from .utils import create_embed, split_message
+from .utils.admission import AdmissionRejected, ask_admission
+from .utils.http import http_clients
+from .utils.jokes import joke_buffer
+from .utils.metrics import metrics
+from .utils.quotes import Quote, QuoteError, quote_service
+from .utils.settings import (
+    ADMIN_USER_ID,
+    ASK_STREAM_RESPONSES,
+    CMC_API_KEY,
+    WEB_FETCH_PREFETCH_RESULTS,
+)
+from .utils.stream import FollowupImagePreview, FollowupStreamer
+
+
+class ElonGPTBot(commands.Bot):
+    """Bot that owns the long-lived resources commands share.
+
+    They are opened in setup_hook, once the event loop exists, and released in
+    close() before the gateway disconnects: bot.run() returns, and asyncio.run
+    cancels whatever is left, as soon as discord.py's own close() is done, so
+    teardown after it would be cut short. Everything queued before shutdown
+    starts is flushed; a completion a command finishes after that is dropped.
+    """
+
+    async def setup_hook(self) -> None:
+        await http_clients.open()
+        await completion_log.start()
+        html_converter.start()
+        quote_service.start()
+        joke_buffer.start()
+
+        # docker stop sends SIGTERM, which would otherwise kill the process
+        # without running close() at all
+        try:
+            asyncio.get_running_loop().add_signal_handler(
+                signal.SIGTERM, lambda: asyncio.create_task(self.close())
+            )
+        except NotImplementedError:
+            pass  # Windows event loops have no signal handlers
+
+    async def close(self) -> None:
+        await quote_service.stop()
+        await joke_buffer.stop()
+        await completion_log.stop()
+        await http_clients.close()
+        html_converter.stop()
+        await super().close()
+
+
+bot = ElonGPTBot(command_prefix=".", intents=discord.Intents.all())
+
+
+# /ask context comes from these events rather than a history() call per /ask.
+# The raw variants fire even for messages that fell out of discord.py's own
+# message cache
+@bot.listen()
+async def on_message(message: discord.Message):
+    channel_history.add(message)
+
+
+@bot.listen()
+async def on_raw_message_edit(payload: discord.RawMessageUpdateEvent):
+    if "content" in payload.data:
+        channel_history.edit(
+            payload.channel_id, payload.message_id, payload.data["content"]
+        )
+
+
+@bot.listen()
+async def on_raw_message_delete(payload: discord.RawMessageDeleteEvent):
+    channel_history.delete(payload.channel_id, {payload.message_id})
+
+
+@bot.listen()
+async def on_raw_bulk_message_delete(payload: discord.RawBulkMessageDeleteEvent):
+    channel_history.delete(payload.channel_id, payload.message_ids)
+
+
+# the "Online users" line is kept the same way. Guilds are loaded in full when
+# they become ready, then adjusted member by member
+@bot.listen()
+async def on_ready():
+    for guild in bot.guilds:
+        presence_index.load(guild)
+
+
+@bot.listen()
+async def on_guild_available(guild: discord.Guild):
+    presence_index.load(guild)
+
+
+@bot.listen()
+async def on_guild_join(guild: discord.Guild):
+    presence_index.load(guild)
+
+
+@bot.listen()
+async def on_guild_remove(guild: discord.Guild):
+    presence_index.forget(guild)
+
+
+@bot.listen()
+async def on_presence_update(_before: discord.Member, after: discord.Member):
+    presence_index.update(after)
+
+
+@bot.listen()
+async def on_member_update(_before: discord.Member, after: discord.Member):
+    presence_index.update(after)  # nickname changes
+
+
+@bot.listen()
+async def on_member_join(member: discord.Member):
+    presence_index.update(member)
+
+
+@bot.listen()
+async def on_member_remove(member: discord.Member):
+    presence_index.remove(member)
 
-bot = commands.Bot(command_prefix=".", intents=discord.Intents.all())
 
 # sized for search -> fetch -> fetch again -> answer; at 3 the model falls
 # through to the "No response" embed on multi-step questions
 TOOL_LOOP_ROUNDS = 5
+CACHED_ANSWER_NOTE = "-# This was asked before, so here's the answer given then."
+SHARED_ANSWER_NOTE = "-# Someone here just asked the same thing, so here's that answer."
+# /price symbols per command; one embed stays readable up to this many
+MAX_PRICE_SYMBOLS = 10
 
 
 @bot.tree.command(name="synccommands", description="Sync commands with discord")
@@ -37,6 +170,66 @@ async def sync_commands(interaction: discord.Interaction):
         await interaction.response.send_message(f"Failed to sync commands: {e}")
 
 
+@bot.tree.command(name="stats", description="Show the bot's internal metrics")
+async def stats_command(interaction: discord.Interaction):
+    if str(interaction.user.id) != ADMIN_USER_ID:
+        return await interaction.response.send_message(
+            "You are not allowed to use this command"
+        )
+
+    lines = [
+        f"{name}: {value:.3f}" if isinstance(value, float) else f"{name}: {value}"
+        for name, value in metrics.snapshot().items()
+    ]
+    report = "\n".join(lines) or "No metrics recorded yet."
+
+    chunks = split_message(f"```\n{report}\n```")
+    await interaction.response.send_message(chunks[0], ephemeral=True)
+    for chunk in chunks[1:]:
+        await interaction.followup.send(chunk, ephemeral=True)
+
+
+@bot.tree.command(name="purgeanswers", description="Forget cached /ask answers")
+@discord.app_commands.describe(
+    everywhere="Purge every server's cached answers, not just this one's"
+)
+async def purge_answers_command(
+    interaction: discord.Interaction, everywhere: bool = False
+):
+    if str(interaction.user.id) != ADMIN_USER_ID:
+        return await interaction.response.send_message(
+            "You are not allowed to use this command"
+        )
+
+    guild_id = interaction.guild.id if interaction.guild else None
+    purged = answer_cache.purge(guild_id, everywhere=everywhere)
+    await interaction.response.send_message(
+        f"Purged {purged} cached answers", ephemeral=True
+    )
+
+
+async def _send_cached_answer(
+    interaction: discord.Interaction, question: str, cached: CachedAnswer
+):
+    posted = cached.text
+    if cached.user_id != interaction.user.id:
+        posted = f"{CACHED_ANSWER_NOTE}\n{posted}"
+
+    chunks = split_message(posted)
+    no_mentions = discord.AllowedMentions.none()
+
+    await interaction.response.send_message(chunks[0], allowed_mentions=no_mentions)
+    for chunk in chunks[1:]:
+        await interaction.followup.send(chunk, allowed_mentions=no_mentions)
+
+    try:
+        db_insert_completion(
+            prompt=question, completion=cached.text, discord_user=str(interaction.user)
+        )
+    except Exception as e:
+        print(f"Failed to log completion: {e}")
+
+
 @bot.tree.command(
     name="ask", description="Ask a question, schedule an event, perform tasks"
 )
@@ -57,101 +250,190 @@ async def ask_command(
     image4: discord.Attachment = None,
     image5: discord.Attachment = None,
 ):
-    await interaction.response.defer()
-
     files = [image1, image2, image3, image4, image5]
     user_name = str(interaction.user)
-    context = await get_chat_context(interaction)
 
+    # an evergreen question answered before needs neither the model nor a
+    # place in the queue
+    cache_key = None if any(files) else answer_cache_key(interaction, question)
+    cached = answer_cache.get(cache_key) if cache_key else None
+    if cached is not None:
+        return await _send_cached_answer(interaction, question, cached)
+
+    # a full queue is refused before deferring, so the user hears it at once
+    # and privately instead of after a "thinking..." message
     try:
-        base64_images = []
-        for file in files:
-            if file is not None:
-                file_data = await file.read()
-                image_base64 = image_to_base64(file_data)
-                base64_images.append(image_base64)
-
-        message = await get_chat_completion(
+        ticket = ask_admission.enter(
+            interaction.user.id, interaction.guild.id if interaction.guild else None
+        )
+    except AdmissionRejected as e:
+        embed = create_embed(title="Busy", description=str(e))
+        return await interaction.response.send_message(embed=embed, ephemeral=True)
+
+    try:
+        await interaction.response.defer()
+    except Exception:
+        ticket.release()
+        raise
+
+    queue_notice_shown = False
+
+    async def show_position(position: int):
+        nonlocal queue_notice_shown
+        queue_notice_shown = True
+        await interaction.edit_original_response(
+            content=f"⏳ Lots of questions right now — you're #{position} in line."
+        )
+
+    streamer = FollowupStreamer(interaction) if ASK_STREAM_RESPONSES else None
+    prefetch = Prefetcher() if WEB_FETCH_PREFETCH_RESULTS > 0 else None
+
+    async def complete(conversation: Conversation, tool_choice: str | None = None):
+        if streamer is None:
+            return await get_chat_completion(conversation, tool_choice)
+
+        # every round streams: whether a round is the final answer or another
+        # set of tool calls is only known once its deltas arrive
+        return await stream_chat_completion(conversation, streamer.push, tool_choice)
+
+    async def answer(context: str, base64_images: list[str]) -> str:
+        started = time.monotonic()
+        conversation = Conversation(
             prompt=question,
             user_name=user_name,
             files=base64_images if len(base64_images) > 0 else None,
             context=context,
             tools=TOOL_DEFINITIONS,
         )
+        message = await complete(conversation)
+        # an answer that needed no tool and saw no image depends on nothing
+        # but the question, so the next person to ask it can reuse it
+        cacheable = cache_key is not None and not message.tool_calls
 
-        tool_messages = []
         for attempt in range(TOOL_LOOP_ROUNDS):
             if not message.tool_calls:
                 break
 
-            tool_messages.append(message.to_dict())
-
             # run a round's calls concurrently — a search plus two fetches would
             # otherwise pay three sequential HTTP + helper-model round trips.
-            # gather preserves order, so the tool_call_id pairing below is safe
+            # gather preserves order, so add_tool_round pairs each result with
+            # its tool_call_id
             results = await asyncio.gather(
                 *(
                     execute_tool_call(
-                        tc.function.name, tc.function.arguments, interaction.guild
+                        tc.function.name,
+                        tc.function.arguments,
+                        interaction.guild,
+                        prefetch,
                     )
                     for tc in message.tool_calls
                 )
             )
-
-            for tc, result in zip(message.tool_calls, results):
-                tool_messages.append(
-                    {
-                        "role": "tool",
-                        "tool_call_id": tc.id,
-                        "content": result,
-                    }
-                )
+            conversation.add_tool_round(message, results)
 
             # the last round must answer in prose: another set of tool calls
             # would drop out of the loop with empty content, throwing away
             # every round (and every fetch) already paid for
             last_round = attempt == TOOL_LOOP_ROUNDS - 1
 
-            message = await get_chat_completion(
-                prompt=question,
-                user_name=user_name,
-                files=base64_images if len(base64_images) > 0 else None,
-                context=context,
-                tools=TOOL_DEFINITIONS,
-                tool_choice="none" if last_round else None,
-                tool_messages=tool_messages,
+            message = await complete(
+                conversation, tool_choice="none" if last_round else None
             )
 
         response = (message.content or "").strip()
+        if cacheable and response:
+            answer_cache.store(
+                cache_key,
+                CachedAnswer(
+                    text=response,
+                    user_id=interaction.user.id,
+                    generation_seconds=time.monotonic() - started,
+                ),
+            )
+
+        return response
+
+    try:
+        await ticket.wait(show_position)
+        if queue_notice_shown:
+            # the answer arrives as follow-ups, so the notice would linger
+            await interaction.delete_original_response()
+
+        # neither depends on the other, and both wait on Discord
+        context, base64_images = await asyncio.gather(
+            get_chat_context(interaction), ingest_images(files)
+        )
+
+        # an identical question just asked in this channel shares its answer
+        key = coalesce_key(interaction, question, base64_images)
+        shared = False
+        if key is None:
+            response = await answer(context, base64_images)
+        else:
+            if ask_coalescer.has_answer(key):
+                ticket.release()  # following another request costs nothing
+            response, shared = await ask_coalescer.run(
+                key, lambda: answer(context, base64_images)
+            )
+            if shared:
+                print(f"Ask: {user_name} shares an answer to {question!r}")
 
         if not response:
+            if streamer is not None:
+                await streamer.finish("")  # clear any preamble already shown
+
             embed = create_embed(
                 title="No response",
                 description="The model didn't return a final answer. Please try again.",
             )
             return await interaction.followup.send(embed=embed)
 
+        # a shared answer was written for whoever asked first, name and all
+        posted = f"{SHARED_ANSWER_NOTE}\n{response}" if shared else response
+
         # Discord rejects message content over 2000 characters, and a tool-using
         # answer (news roundups especially) routinely runs longer than that.
         # Mentions are pinned off because the answer can echo untrusted web page
         # text — otherwise "start your reply with @everyone" is a working attack
-        for chunk in split_message(response):
-            await interaction.followup.send(
-                chunk, allowed_mentions=discord.AllowedMentions.none()
-            )
+        if streamer is not None:
+            await streamer.finish(posted)
+        else:
+            for chunk in split_message(posted):
+                await interaction.followup.send(
+                    chunk, allowed_mentions=discord.AllowedMentions.none()
+                )
 
         try:
-            await db_insert_completion(
+            db_insert_completion(
                 prompt=question, completion=response, discord_user=user_name
             )
         except Exception as e:
             print(f"Failed to log completion: {e}")
 
+    except AdmissionRejected as e:
+        # only wait() raises it here, so the original response is still the
+        # "thinking..." or queue notice, and becomes the rejection
+        embed = create_embed(title="Busy", description=str(e))
+        await interaction.edit_original_response(content=None, embed=embed)
+
     except Exception as e:
+        # a half-streamed answer is cleared first: otherwise the pending flush
+        # can land after the error embed, or the partial text stands as if final
+        if streamer is not None:
+            try:
+                await streamer.finish("")
+            except Exception as cleanup_error:
+                print(f"Failed to clear streamed answer: {cleanup_error}")
+
         embed = create_embed(title="Unknown Error:", description=str(e))
         await interaction.followup.send(embed=embed)
         print(f"Error: {e}")
 
+    finally:
+        ticket.release()
+        if prefetch is not None:
+            prefetch.close()  # pages the model never asked for
+
 
 @bot.tree.command(name="imagine", description="Generate an image")
 @discord.app_commands.describe(
@@ -162,27 +444,38 @@ async def imagine(
     description: str,
 ):
     await interaction.response.defer()
+    # generation takes long enough that an early rough version is worth
+    # showing; it is replaced in place when the final image arrives
+    preview = FollowupImagePreview(interaction, IMAGE_FILENAME)
 
     try:
-        image_bytes = await generate_image(description)
-
-        file = discord.File(io.BytesIO(image_bytes), filename="image.png")
-        await interaction.followup.send(file=file)
+        image_bytes = await generate_image(description, preview.push)
+        await preview.finish(image_bytes)
 
     except Exception as e:
+        await preview.discard()
         embed = create_embed(title="Unknown Error:", description=e)
         await interaction.followup.send(embed=embed)
         print(f"Unknown Error: {e}")
 
 
+def _describe_quote(quote: Quote | None) -> str:
+    if quote is None:
+        return "Invalid cryptocurrency symbol"
+
+    price = "n/a" if quote.price is None else f"${quote.price:.2f}"
+    market_cap = "n/a" if quote.market_cap is None else f"${quote.market_cap:.2f}"
+    return f"**Price:** {price}\n**Market Cap:** {market_cap}"
+
+
 @bot.tree.command(
     name="price",
-    description="Get the price and market capitalization of a cryptocurrency",
+    description="Get the price and market capitalization of cryptocurrencies",
 )
 @discord.app_commands.describe(
-    symbol="The cryptocurrency symbol you want to get the price for"
+    symbols="One or more cryptocurrency symbols, separated by spaces or commas"
 )
-async def price(interaction: discord.Interaction, symbol: str):
+async def price(interaction: discord.Interaction, symbols: str):
     if CMC_API_KEY is None:
         embed = create_embed(
             title="Not configured",
@@ -191,36 +484,37 @@ async def price(interaction: discord.Interaction, symbol: str):
 
         return await interaction.response.send_message(embed=embed)
 
-    try:
-        api_url = "https://pro-api.coinmarketcap.com/v1/cryptocurrency/quotes/latest"
-        crypto_symbol = symbol.upper()
-
-        params = {"symbol": crypto_symbol, "convert": "USD"}
-        headers = {"X-CMC_PRO_API_KEY": CMC_API_KEY}
+    wanted = [symbol for symbol in re.split(r"[\s,]+", symbols) if symbol]
+    if not wanted or len(wanted) > MAX_PRICE_SYMBOLS:
+        embed = create_embed(
+            title="Invalid symbols",
+            description=f"Give between 1 and {MAX_PRICE_SYMBOLS} symbols.",
+        )
 
-        async with httpx.AsyncClient() as client:
-            response = await client.get(api_url, params=params, headers=headers)
+        return await interaction.response.send_message(embed=embed)
 
-        if response.status_code != 200:
-            embed = create_embed(
-                title="API Error",
-                description=f"Could not get price and market capitalization for {crypto_symbol}",
+    try:
+        quotes = await quote_service.get_quotes(wanted)
+
+        if len(quotes) == 1:
+            [(symbol, quote)] = quotes.items()
+            embed = create_embed(title=symbol, description=_describe_quote(quote))
+        else:
+            description = "\n\n".join(
+                f"__{symbol}__\n{_describe_quote(quote)}"
+                for symbol, quote in quotes.items()
             )
-
-            return await interaction.response.send_message(embed=embed)
-
-        data = response.json()
-        price = data["data"][crypto_symbol]["quote"]["USD"]["price"]
-        market_cap = data["data"][crypto_symbol]["quote"]["USD"]["market_cap"]
-        api_response = f"**Price:** ${price:.2f}\n**Market Cap:** ${market_cap:.2f}"
-        embed = create_embed(title=crypto_symbol, description=api_response)
+            embed = create_embed(title="Prices", description=description)
 
         await interaction.response.send_message(embed=embed)
 
-    except KeyError as e:
-        embed = create_embed(title=e, description="Invalid cryptocurrency symbol")
+    except QuoteError as e:
+        embed = create_embed(
+            title="API Error",
+            description=f"Could not get price and market capitalization: {e}",
+        )
         await interaction.response.send_message(embed=embed)
-        print(f"API Error: {e}, Invalid cryptocurrency symbol")
+        print(f"API Error: {e}")
 
     except Exception as e:
         embed = create_embed(title="API Error", description=e)
@@ -231,22 +525,12 @@ async def price(interaction: discord.Interaction, symbol: str):
 @bot.tree.command(name="joke", description="Get a Chuck Norris joke")
 async def joke_command(interaction: discord.Interaction):
     try:
-        joke_url = "https://api.chucknorris.io/jokes/random"
-
-        async with httpx.AsyncClient() as client:
-            joke_response = await client.get(joke_url)
-        joke_response.raise_for_status()
-        joke_json = joke_response.json()
-        joke_content = joke_json.get("value")
+        joke_content = await joke_buffer.get()
 
         view = View()
 
         async def new_joke_callback(interaction: discord.Interaction):
-            async with httpx.AsyncClient() as client:
-                new_joke_response = await client.get(joke_url)
-            new_joke_response.raise_for_status()
-            new_joke_json = new_joke_response.json()
-            new_joke_content = new_joke_json.get("value")
+            new_joke_content = await joke_buffer.get()
             await interaction.response.edit_message(content=new_joke_content)
 
         button = Button(label="Get Another Joke", style=discord.ButtonStyle.primary)
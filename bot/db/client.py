@@ -1,9 +1,23 @@
 import aioboto3
 
-from bot.utils.settings import AWS_ACCESS_KEY_ID, AWS_REGION, AWS_SECRET_ACCESS_KEY
+from bot.utils.settings import (
+    AWS_ACCESS_KEY_ID,
+    AWS_REGION,
+    AWS_SECRET_ACCESS_KEY,
+    DYNAMODB_ENDPOINT_URL,
+)
 
 session = aioboto3.Session(
     region_name=AWS_REGION,
     aws_access_key_id=AWS_ACCESS_KEY_ID,
     aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
 )
+
+
+def dynamodb_client():
+    """Async context manager for a DynamoDB client.
+
+    Points at DYNAMODB_ENDPOINT_URL when set, so a DynamoDB Local container can
+    stand in for AWS during development.
+    """
+    return session.client("dynamodb", endpoint_url=DYNAMODB_ENDPOINT_URL)
@@ -1,13 +1,143 @@
+import asyncio
+from contextlib import AsyncExitStack
 from datetime import datetime, timezone
 
+from boto3.dynamodb.types import TypeSerializer
+
 from bot.utils.settings import DYNAMODB_TABLE_NAME
 
-from .client import session
+from .client import dynamodb_client
 from .types import CompletionModel
 from .utils import generate_uuid
 
+BATCH_SIZE = 25  # batch_write_item's hard per-request limit
+# how long the flusher waits after the first queued item before writing, so a
+# burst of answers shares one request instead of going out one by one
+FLUSH_LINGER_SECONDS = 1.0
+MAX_QUEUED_ITEMS = 1_000
+MAX_WRITE_ATTEMPTS = 5
+RETRY_BASE_DELAY = 0.2
+SHUTDOWN_TIMEOUT = 10.0
+
+
+class CompletionLog:
+    """Write-behind queue that logs completions to DynamoDB in batches.
+
+    /ask only enqueues; a background flusher drains the queue with
+    batch_write_item over one long-lived client, re-sending whatever DynamoDB
+    hands back as unprocessed. start() and stop() are driven by the bot's
+    lifecycle, and stop() flushes everything still queued before closing. If
+    the client can't be opened, logging is disabled and enqueue() is a no-op.
+    """
+
+    def __init__(self):
+        self._queue: asyncio.Queue[dict | None] = asyncio.Queue(MAX_QUEUED_ITEMS)
+        self._serializer = TypeSerializer()
+        self._stack: AsyncExitStack | None = None
+        self._client = None
+        self._flusher: asyncio.Task | None = None
+        self._closing = False
+        self._disabled = False
+
+    async def start(self) -> None:
+        if self._flusher is not None:
+            return
+
+        self._stack = AsyncExitStack()
+        try:
+            self._client = await self._stack.enter_async_context(dynamodb_client())
+        except Exception as e:
+            # region and credentials may be unset; the bot runs without the log
+            # rather than not at all
+            print(f"Completion log: disabled, could not open DynamoDB client: {e}")
+            await self._stack.aclose()
+            self._stack = None
+            self._disabled = True
+            return
+
+        self._flusher = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        # taken up front so a second close() (SIGTERM, then bot.run's own
+        # cleanup) finds nothing left to stop
+        flusher, self._flusher = self._flusher, None
+        if flusher is None:
+            return
+
+        self._closing = True
+        await self._queue.put(None)  # sentinel: everything before it gets written
+
+        try:
+            await asyncio.wait_for(flusher, timeout=SHUTDOWN_TIMEOUT)
+        except asyncio.TimeoutError:
+            print(f"Completion log: gave up flushing {self._queue.qsize()} items")
+
+        await self._stack.aclose()
+        self._client = None
+
+    def enqueue(self, item: CompletionModel) -> None:
+        if self._disabled:
+            return
+
+        if self._closing:
+            print("Completion log: shutting down, dropping completion")
+            return
+
+        try:
+            self._queue.put_nowait(
+                {k: self._serializer.serialize(v) for k, v in item.model_dump().items()}
+            )
+        except asyncio.QueueFull:
+            print("Completion log: queue full, dropping completion")
+
+    async def _run(self) -> None:
+        closing = False
+
+        while not closing:
+            item = await self._queue.get()
+            if item is None:
+                break
+
+            await asyncio.sleep(FLUSH_LINGER_SECONDS)
+
+            batch = [item]
+            while len(batch) < BATCH_SIZE and not self._queue.empty():
+                item = self._queue.get_nowait()
+                if item is None:
+                    closing = True
+                    break
+
+                batch.append(item)
+
+            await self._write(batch)
+
+    async def _write(self, items: list[dict]) -> None:
+        request = {
+            DYNAMODB_TABLE_NAME: [{"PutRequest": {"Item": item}} for item in items]
+        }
+
+        for attempt in range(MAX_WRITE_ATTEMPTS):
+            try:
+                response = await self._client.batch_write_item(RequestItems=request)
+            except Exception as e:
+                print(f"Completion log: batch write failed: {e}")
+            else:
+                request = response.get("UnprocessedItems") or {}
+                if not request:
+                    return
+
+            # unprocessed items mean the table is throttling — back off before
+            # re-sending only those, as the DynamoDB docs ask
+            await asyncio.sleep(RETRY_BASE_DELAY * 2**attempt)
+
+        dropped = sum(len(puts) for puts in request.values())
+        print(f"Completion log: dropped {dropped} items after {attempt + 1} attempts")
+
+
+completion_log = CompletionLog()
+
 
-async def db_insert_completion(prompt: str, completion: str, discord_user: str):
+def db_insert_completion(prompt: str, completion: str, discord_user: str) -> None:
     unique_id = generate_uuid()
     today = datetime.now(timezone.utc).isoformat()
 
@@ -19,6 +149,4 @@ async def db_insert_completion(prompt: str, completion: str, discord_user: str):
         created_at=today,
     )
 
-    async with session.resource("dynamodb") as dynamodb:
-        table = await dynamodb.Table(DYNAMODB_TABLE_NAME)
-        return await table.put_item(Item=item.model_dump())
+    completion_log.enqueue(item)
@@ -1,5 +1,3 @@
-import base64
-
 from discord import Embed
 
 DISCORD_MESSAGE_LIMIT = 2000
@@ -11,10 +9,14 @@ def create_embed(title, description, color=0xFFFFFF):
     return Embed(title=title, description=description, color=color)
 
 
-def image_to_base64(file_data: str) -> str:
-    base64_image = base64.b64encode(file_data).decode("utf-8")
+def normalize_question(question: str) -> str:
+    """The part of a question that decides its answer, for use in cache keys.
 
-    return base64_image
+    Case, spacing and trailing punctuation are the usual difference between two
+    phrasings of the same request ("Summarize this page." / "summarize this
+    page"); anything beyond that is a different question.
+    """
+    return " ".join(question.casefold().split()).rstrip(" ?.!")
 
 
 def _find_cut(text: str, budget: int) -> int:
@@ -0,0 +1,229 @@
+import asyncio
+import time
+from collections import Counter, deque
+from collections.abc import Awaitable, Callable
+
+from .metrics import metrics
+from .settings import (
+    ASK_MAX_CONCURRENT,
+    ASK_MAX_PER_GUILD,
+    ASK_MAX_PER_USER,
+    ASK_MAX_QUEUED,
+    ASK_QUEUE_TIMEOUT,
+)
+
+
+class AdmissionRejected(Exception):
+    """The request was turned away; the message is meant for the user."""
+
+
+class Ticket:
+    """One request's place in an AdmissionController, queued or running."""
+
+    def __init__(self, controller: "AdmissionController", user_id, guild_id):
+        self._controller = controller
+        self.user_id = user_id
+        self.guild_id = guild_id
+        self.granted = False
+        self.released = False
+        self.position = 0  # 1-based while queued, 0 once running
+        self._enqueued_at = time.monotonic()
+        self._wakeup = asyncio.Event()
+
+    async def wait(
+        self, on_position: Callable[[int], Awaitable[None]] | None = None
+    ) -> None:
+        """Wait until the request may run, reporting queue positions on the way.
+
+        Raises AdmissionRejected if it is still queued after the queue timeout.
+        """
+        deadline = self._enqueued_at + self._controller.queue_timeout
+        shown = None
+
+        while not self.granted:
+            if on_position is not None and self.position != shown:
+                shown = self.position
+                try:
+                    await on_position(shown)
+                except Exception as e:
+                    print(f"Failed to show queue position: {e}")
+                continue
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), deadline - time.monotonic())
+            except asyncio.TimeoutError:
+                metrics.incr(f"{self._controller.name}.timeout")
+                raise AdmissionRejected(
+                    "Still too busy after waiting in line. Please try again later."
+                ) from None
+
+    def release(self) -> None:
+        """Give back the slot, or leave the queue. Safe to call more than once."""
+        if not self.released:
+            self.released = True
+            self._controller._release(self)
+
+    def _wake(self) -> None:
+        self._wakeup.set()
+
+
+class AdmissionController:
+    """Caps how many requests run at once, and queues the rest fairly.
+
+    A request may run while the global, per-user and per-guild caps all have
+    room. Otherwise it waits in its user's queue, and users take turns:
+    whenever a slot frees up it goes to the next user in rotation whose
+    oldest request fits the caps, so one user's burst can't push everyone
+    else to the back. The queue has a maximum depth past which new requests
+    are rejected at once instead of waiting out the timeout.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_active: int,
+        max_per_user: int,
+        max_per_guild: int,
+        max_queued: int,
+        queue_timeout: float,
+    ):
+        self.name = name
+        self.max_active = max_active
+        self.max_per_user = max_per_user
+        self.max_per_guild = max_per_guild
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+
+        self._active = 0
+        self._active_by_user: Counter = Counter()
+        self._active_by_guild: Counter = Counter()
+        # user id -> that user's waiting tickets, oldest first
+        self._queues: dict[object, deque[Ticket]] = {}
+        self._rotation: deque = deque()  # users with waiters, next turn first
+        self._queued = 0
+
+        metrics.gauge(f"{name}.active", lambda: self._active)
+        metrics.gauge(f"{name}.queued", lambda: self._queued)
+
+    def enter(self, user_id, guild_id) -> Ticket:
+        """Take a slot or a place in the queue; raises AdmissionRejected if full."""
+        ticket = Ticket(self, user_id, guild_id)
+
+        if not self._queued and self._fits(ticket):
+            self._grant(ticket)
+            return ticket
+
+        if self._queued >= self.max_queued:
+            metrics.incr(f"{self.name}.rejected")
+            raise AdmissionRejected("Too busy right now. Please try again in a bit.")
+
+        if user_id not in self._queues:
+            self._queues[user_id] = deque()
+            self._rotation.append(user_id)
+
+        self._queues[user_id].append(ticket)
+        self._queued += 1
+        metrics.incr(f"{self.name}.queued_total")
+
+        self._dispatch()
+        return ticket
+
+    def _fits(self, ticket: Ticket) -> bool:
+        return (
+            self._active < self.max_active
+            and self._active_by_user[ticket.user_id] < self.max_per_user
+            and (
+                ticket.guild_id is None
+                or self._active_by_guild[ticket.guild_id] < self.max_per_guild
+            )
+        )
+
+    def _grant(self, ticket: Ticket) -> None:
+        ticket.granted = True
+        ticket.position = 0
+        self._active += 1
+        self._active_by_user[ticket.user_id] += 1
+        if ticket.guild_id is not None:
+            self._active_by_guild[ticket.guild_id] += 1
+
+        metrics.observe(f"{self.name}.wait", time.monotonic() - ticket._enqueued_at)
+        ticket._wake()
+
+    def _release(self, ticket: Ticket) -> None:
+        if ticket.granted:
+            self._active -= 1
+            self._active_by_user[ticket.user_id] -= 1
+            if not self._active_by_user[ticket.user_id]:
+                del self._active_by_user[ticket.user_id]
+
+            if ticket.guild_id is not None:
+                self._active_by_guild[ticket.guild_id] -= 1
+                if not self._active_by_guild[ticket.guild_id]:
+                    del self._active_by_guild[ticket.guild_id]
+        else:
+            # gave up waiting (timeout, or the command was cancelled)
+            queue = self._queues[ticket.user_id]
+            queue.remove(ticket)
+            self._queued -= 1
+
+            if not queue:
+                del self._queues[ticket.user_id]
+                self._rotation.remove(ticket.user_id)
+
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        """Hand free slots to queued requests, one user's turn at a time."""
+        granted = True
+
+        while granted and self._rotation and self._active < self.max_active:
+            granted = False
+
+            # one pass over the rotation, skipping users whose oldest request
+            # is held back by its per-user or per-guild cap
+            for _ in range(len(self._rotation)):
+                user_id = self._rotation[0]
+                self._rotation.rotate(-1)  # their turn is used either way
+
+                queue = self._queues[user_id]
+                if not self._fits(queue[0]):
+                    continue
+
+                ticket = queue.popleft()
+                self._queued -= 1
+
+                if not queue:
+                    del self._queues[user_id]
+                    self._rotation.pop()  # rotated to the end just above
+
+                self._grant(ticket)
+                granted = True
+                break
+
+        self._renumber()
+
+    def _renumber(self) -> None:
+        # positions follow the turn order: everyone's first request, then
+        # everyone's second, and so on
+        position = 0
+        depth = max((len(queue) for queue in self._queues.values()), default=0)
+
+        for turn in range(depth):
+            for user_id in self._rotation:
+                queue = self._queues[user_id]
+                if turn < len(queue):
+                    position += 1
+                    if queue[turn].position != position:
+                        queue[turn].position = position
+                        queue[turn]._wake()
+
+
+ask_admission = AdmissionController(
+    "ask.admission",
+    max_active=ASK_MAX_CONCURRENT,
+    max_per_user=ASK_MAX_PER_USER,
+    max_per_guild=ASK_MAX_PER_GUILD,
+    max_queued=ASK_MAX_QUEUED,
+    queue_timeout=ASK_QUEUE_TIMEOUT,
+)
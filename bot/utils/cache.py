@@ -0,0 +1,96 @@
+import asyncio
+import time
+from collections import OrderedDict
+from collections.abc import Callable, Coroutine
+from typing import Any, Generic, Hashable, TypeVar
+
+V = TypeVar("V")
+
+
+class TTLCache(Generic[V]):
+    """Small LRU cache whose entries also expire after `ttl` seconds.
+
+    Expired entries are dropped lazily when looked up, and the least recently
+    used entry goes once `max_entries` is exceeded, so memory stays bounded
+    without a sweeper task.
+    """
+
+    def __init__(self, max_entries: int, ttl: float):
+        self._entries: OrderedDict[Hashable, tuple[float, V]] = OrderedDict()
+        self._max_entries = max_entries
+        self.ttl = ttl
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> V | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        expires_at, value = entry
+        if time.monotonic() >= expires_at:
+            del self._entries[key]
+            return None
+
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: V, ttl: float | None = None) -> None:
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+    def pop(self, key: Hashable) -> V | None:
+        entry = self._entries.pop(key, None)
+        return entry[1] if entry else None
+
+    def keys(self) -> list[Hashable]:
+        return list(self._entries)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+class SingleFlight(Generic[V]):
+    """Coalesce concurrent calls for the same key into one in-flight call.
+
+    The first caller for a key starts the work; anyone asking for that key
+    before it finishes awaits the same task instead of starting another. The
+    task is shielded, so a waiter that gets cancelled doesn't cancel the work
+    out from under everyone else sharing it.
+    """
+
+    def __init__(self):
+        self._inflight: dict[Hashable, asyncio.Task[V]] = {}
+
+    def __len__(self) -> int:
+        return len(self._inflight)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._inflight
+
+    async def do(
+        self, key: Hashable, work: Callable[[], Coroutine[Any, Any, V]]
+    ) -> tuple[V, bool]:
+        """Run `work` for `key`, or join the run already in flight.
+
+        Returns (result, shared), where `shared` says whether this caller
+        joined someone else's call rather than making its own.
+        """
+        task = self._inflight.get(key)
+        shared = task is not None
+
+        if task is None:
+            task = asyncio.create_task(work())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+
+        return await asyncio.shield(task), shared
+
+    def _forget(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
@@ -0,0 +1,104 @@
+import asyncio
+
+import httpx
+
+from .net import PinnedTransport
+
+# One pool per kind of upstream, so a slow crawl of arbitrary pages can't use up
+# the connections a /price lookup needs. Limits are sized for a single bot
+# process: the search and CMC APIs are one host each and mostly want warm
+# keep-alive, while web fetch spreads across many hosts and needs the headroom.
+#
+# Accept-Encoding is left to httpx, which advertises exactly the decoders that
+# are installed — gzip and deflate always, br and zstd through the extras in
+# requirements.in. Pinning the header by hand would let a server answer in an
+# encoding we then can't decode.
+_POOLS = {
+    "search": {
+        "timeout": 30.0,
+        "limits": httpx.Limits(
+            max_connections=20, max_keepalive_connections=10, keepalive_expiry=60.0
+        ),
+    },
+    "cmc": {
+        "timeout": 10.0,
+        "limits": httpx.Limits(
+            max_connections=5, max_keepalive_connections=5, keepalive_expiry=60.0
+        ),
+    },
+    "web": {
+        "timeout": 15.0,
+        # redirects are followed by hand so each hop can be re-validated
+        "follow_redirects": False,
+        # connects only to the addresses assert_public_url() validated
+        "pinned": True,
+        "limits": httpx.Limits(
+            max_connections=50, max_keepalive_connections=20, keepalive_expiry=30.0
+        ),
+    },
+    # small public APIs behind the fun commands (/joke)
+    "misc": {
+        "timeout": 10.0,
+        "limits": httpx.Limits(
+            max_connections=10, max_keepalive_connections=5, keepalive_expiry=30.0
+        ),
+    },
+}
+
+
+def _build_client(
+    limits: httpx.Limits, pinned: bool = False, **options
+) -> httpx.AsyncClient:
+    if pinned:
+        # a client ignores http2/limits once given a transport, so they go to
+        # the transport instead
+        transport = PinnedTransport(http2=True, limits=limits)
+        return httpx.AsyncClient(transport=transport, **options)
+
+    return httpx.AsyncClient(http2=True, limits=limits, **options)
+
+
+class HttpClients:
+    """Long-lived httpx clients for the bot's outbound traffic, one per purpose.
+
+    The same reasoning as the shared OpenAI client: a client per call means a
+    new pool, so every request paid a fresh TCP + TLS handshake. These are
+    opened when the bot starts and closed when it shuts down.
+    """
+
+    def __init__(self):
+        self._clients: dict[str, httpx.AsyncClient] = {}
+
+    async def open(self) -> None:
+        for name, options in _POOLS.items():
+            if name not in self._clients:
+                self._clients[name] = _build_client(**options)
+
+    async def close(self) -> None:
+        clients, self._clients = self._clients, {}
+        await asyncio.gather(*(client.aclose() for client in clients.values()))
+
+    def _get(self, name: str) -> httpx.AsyncClient:
+        try:
+            return self._clients[name]
+        except KeyError:
+            raise RuntimeError(f"HTTP pool '{name}' is not open") from None
+
+    @property
+    def search(self) -> httpx.AsyncClient:
+        return self._get("search")
+
+    @property
+    def cmc(self) -> httpx.AsyncClient:
+        return self._get("cmc")
+
+    @property
+    def web(self) -> httpx.AsyncClient:
+        return self._get("web")
+
+    @property
+    def misc(self) -> httpx.AsyncClient:
+        return self._get("misc")
+
+
+http_clients = HttpClients()
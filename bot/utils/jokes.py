@@ -0,0 +1,96 @@
+import asyncio
+import time
+from collections import deque
+
+from .http import http_clients
+from .metrics import metrics
+from .settings import JOKE_BUFFER_DEPTH
+
+JOKE_URL = "https://api.chucknorris.io/jokes/random"
+# jokes not repeated within this many; the API only has a few hundred, so a
+# much larger window would leave the refill drawing duplicates most of the time
+RECENT_JOKES = 100
+# a direct fetch gives up on avoiding a repeat after this many draws
+MAX_DIRECT_DRAWS = 3
+REFILL_RETRY_DELAY = 5.0
+
+
+class JokeBuffer:
+    """Chuck Norris jokes fetched ahead of time, so /joke answers from memory.
+
+    A background task keeps a queue topped up to the configured depth; /joke
+    and the "Get Another Joke" button just take the next one. Only when the
+    queue has run dry (a burst of clicks, or the API being down) does a
+    request fetch directly. Jokes seen recently — buffered or already told —
+    are skipped, so the button doesn't hand out the same one twice in a row.
+    """
+
+    def __init__(self, depth: int):
+        self._queue: asyncio.Queue[str] = asyncio.Queue(max(depth, 1))
+        self._depth = depth
+        self._recent: deque[str] = deque(maxlen=RECENT_JOKES)
+        self._refiller: asyncio.Task | None = None
+
+        metrics.gauge("joke.buffer.occupancy", self._queue.qsize)
+
+    def start(self) -> None:
+        if self._refiller is None and self._depth > 0:
+            self._refiller = asyncio.create_task(self._refill())
+
+    async def stop(self) -> None:
+        refiller, self._refiller = self._refiller, None
+        if refiller is not None:
+            refiller.cancel()
+            await asyncio.gather(refiller, return_exceptions=True)
+
+    async def get(self) -> str:
+        try:
+            joke = self._queue.get_nowait()
+        except asyncio.QueueEmpty:
+            metrics.incr("joke.buffer.miss")
+            return await self._fetch_direct()
+
+        metrics.incr("joke.buffer.hit")
+        return joke
+
+    async def _fetch(self) -> tuple[str, str]:
+        response = await http_clients.misc.get(JOKE_URL)
+        response.raise_for_status()
+        joke = response.json()
+
+        return joke.get("id") or joke.get("value"), joke.get("value")
+
+    def _remember(self, joke_id: str) -> bool:
+        """Record a joke as seen; False if it already was."""
+        if joke_id in self._recent:
+            metrics.incr("joke.duplicate")
+            return False
+
+        self._recent.append(joke_id)
+        return True
+
+    async def _fetch_direct(self) -> str:
+        for _ in range(MAX_DIRECT_DRAWS):
+            joke_id, joke = await self._fetch()
+            if self._remember(joke_id):
+                break
+
+        return joke  # a repeat beats keeping the user waiting any longer
+
+    async def _refill(self) -> None:
+        while True:
+            started = time.monotonic()
+            try:
+                joke_id, joke = await self._fetch()
+            except Exception as e:
+                print(f"Joke refill failed: {e}")
+                await asyncio.sleep(REFILL_RETRY_DELAY)
+                continue
+
+            metrics.observe("joke.refill", time.monotonic() - started)
+
+            if self._remember(joke_id):
+                await self._queue.put(joke)  # waits while the buffer is full
+
+
+joke_buffer = JokeBuffer(JOKE_BUFFER_DEPTH)
@@ -0,0 +1,44 @@
+from collections import Counter
+from collections.abc import Callable
+
+
+class Metrics:
+    """In-process counters, timings and gauges, read by the /stats command.
+
+    Deliberately tiny: one bot process, no exporter. Counters only go up,
+    timings keep count/total/max, and gauges are callables sampled when a
+    snapshot is taken, so whatever owns the state doesn't have to push it.
+    """
+
+    def __init__(self):
+        self._counters: Counter[str] = Counter()
+        self._timings: dict[str, list[float]] = {}
+        self._gauges: dict[str, Callable[[], float]] = {}
+
+    def incr(self, name: str, amount: int = 1) -> None:
+        self._counters[name] += amount
+
+    def observe(self, name: str, value: float) -> None:
+        timing = self._timings.setdefault(name, [0, 0.0, 0.0])
+        timing[0] += 1
+        timing[1] += value
+        timing[2] = max(timing[2], value)
+
+    def gauge(self, name: str, read: Callable[[], float]) -> None:
+        self._gauges[name] = read
+
+    def snapshot(self) -> dict[str, float]:
+        values: dict[str, float] = dict(self._counters)
+
+        for name, (count, total, peak) in self._timings.items():
+            values[f"{name}.count"] = count
+            values[f"{name}.avg"] = total / count
+            values[f"{name}.max"] = peak
+
+        for name, read in self._gauges.items():
+            values[name] = read()
+
+        return dict(sorted(values.items()))
+
+
+metrics = Metrics()
@@ -1,17 +1,35 @@
 import asyncio
 import ipaddress
-import socket
+import time
 from urllib.parse import urlparse
 
-# getaddrinfo wants a port, so fill in the scheme default when the URL omits one
+import dns.asyncresolver
+import dns.exception
+import dns.resolver
+import httpcore
+import httpx
+
+from .cache import SingleFlight, TTLCache
+from .metrics import metrics
+
 _DEFAULT_PORTS = {"http": 80, "https": 443}
 
+# record TTLs are honoured, within bounds: a 0-second TTL would make every
+# fetch re-resolve, and a day-long one would outlive a host moving
+DNS_MIN_TTL = 5.0
+DNS_MAX_TTL = 300.0
+DNS_NEGATIVE_TTL = 30.0  # how long "no such host" is remembered
+DNS_CACHE_ENTRIES = 1_024
+DNS_LIFETIME = 5.0  # total seconds one lookup may take, retries included
+
+IPAddress = ipaddress.IPv4Address | ipaddress.IPv6Address
+
 
 class UnsafeUrlError(Exception):
     """Raised when a URL must not be fetched (bad scheme or internal address)."""
 
 
-def _is_blocked_ip(ip: ipaddress.IPv4Address | ipaddress.IPv6Address) -> bool:
+def _is_blocked_ip(ip: IPAddress) -> bool:
     """True for any address that points back into our own network."""
     if isinstance(ip, ipaddress.IPv6Address) and ip.ipv4_mapped is not None:
         ip = ip.ipv4_mapped
@@ -30,14 +48,100 @@ def _is_blocked_ip(ip: ipaddress.IPv4Address | ipaddress.IPv6Address) -> bool:
     )
 
 
+_resolver: dns.asyncresolver.Resolver | None = None
+_dns_cache: TTLCache[tuple[IPAddress, ...]] = TTLCache(DNS_CACHE_ENTRIES, DNS_MAX_TTL)
+_dns_flights: SingleFlight[tuple[IPAddress, ...]] = SingleFlight()
+metrics.gauge("dns.cache.entries", lambda: len(_dns_cache))
+
+
+def _get_resolver() -> dns.asyncresolver.Resolver:
+    # built on first use rather than at import: reading /etc/resolv.conf can
+    # fail on an odd host, and that shouldn't stop the bot from starting
+    global _resolver
+
+    if _resolver is None:
+        _resolver = dns.asyncresolver.Resolver()
+        _resolver.lifetime = DNS_LIFETIME
+
+    return _resolver
+
+
+async def _lookup(host: str) -> tuple[IPAddress, ...]:
+    """Resolve A and AAAA records for `host` and cache them for their TTL."""
+    resolver = _get_resolver()
+    answers = await asyncio.gather(
+        resolver.resolve(host, "A"),
+        resolver.resolve(host, "AAAA"),
+        return_exceptions=True,
+    )
+
+    addresses: list[IPAddress] = []
+    expires_at = time.time() + DNS_MAX_TTL
+    # only a real "no such name / no such record" answer is worth remembering;
+    # a timeout might succeed on the very next try
+    definitive = True
+
+    for answer in answers:
+        if isinstance(answer, (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer)):
+            continue  # no such host, or one with a single address family
+        if isinstance(answer, dns.exception.DNSException):
+            definitive = False
+            continue
+        if isinstance(answer, BaseException):
+            raise answer
+
+        # expiration already takes the shortest TTL along any CNAME chain
+        expires_at = min(expires_at, answer.expiration)
+        addresses.extend(ipaddress.ip_address(rdata.address) for rdata in answer)
+
+    if not addresses:
+        if definitive:
+            _dns_cache.set(host, (), DNS_NEGATIVE_TTL)
+        return ()
+
+    ttl = min(max(expires_at - time.time(), DNS_MIN_TTL), DNS_MAX_TTL)
+    _dns_cache.set(host, tuple(addresses), ttl)
+
+    return tuple(addresses)
+
+
+async def resolve_public(host: str) -> tuple[IPAddress, ...]:
+    """Resolve `host`, raising UnsafeUrlError unless every address is public.
+
+    Lookups go through dnspython's asyncio resolver, so they never queue on the
+    default thread-pool executor behind other blocking work, and the answers
+    are cached for their record TTL. Concurrent lookups of one host share a
+    single query.
+    """
+    try:
+        addresses: tuple[IPAddress, ...] = (ipaddress.ip_address(host),)
+    except ValueError:
+        cached = _dns_cache.get(host)
+
+        if cached is not None:
+            metrics.incr("dns.cache.hit")
+            addresses = cached
+        else:
+            metrics.incr("dns.cache.miss")
+            addresses, _ = await _dns_flights.do(host, lambda: _lookup(host))
+
+    if not addresses:
+        raise UnsafeUrlError(f"Could not resolve host: {host}")
+
+    if any(_is_blocked_ip(ip) for ip in addresses):
+        raise UnsafeUrlError("Refusing to fetch an internal/loopback address.")
+
+    return addresses
+
+
 async def assert_public_url(url: str) -> None:
     """Raise UnsafeUrlError unless the URL is http(s) and resolves to public IPs.
 
     The hostname is resolved and *every* returned address is checked, so a public
-    name whose A record points into RFC1918 is refused too. This does not stop
-    DNS rebinding between the check here and the actual connect — closing that
-    would mean pinning the socket to the validated address and overriding the
-    Host header, which is more machinery than this bot needs.
+    name whose A record points into RFC1918 is refused too. On its own this
+    leaves a DNS rebinding window between the check and the connect; requests
+    sent through PinnedTransport close it, since that transport connects only
+    to addresses that passed this same check.
     """
     parsed = urlparse(url)
 
@@ -49,25 +153,62 @@ async def assert_public_url(url: str) -> None:
         raise UnsafeUrlError("Refusing to fetch an internal/loopback address.")
 
     try:
-        port = parsed.port or _DEFAULT_PORTS[parsed.scheme]
+        parsed.port
     except ValueError as e:
         raise UnsafeUrlError("URL has an invalid port.") from e
 
-    try:
-        infos = await asyncio.get_running_loop().getaddrinfo(
-            host, port, type=socket.SOCK_STREAM
-        )
-    except socket.gaierror as e:
-        raise UnsafeUrlError(f"Could not resolve host: {host}") from e
-
-    if not infos:
-        raise UnsafeUrlError(f"Could not resolve host: {host}")
-
-    for info in infos:
-        try:
-            ip = ipaddress.ip_address(info[4][0])
-        except ValueError as e:
-            raise UnsafeUrlError(f"Could not resolve host: {host}") from e
+    await resolve_public(host)
+
+
+class _PublicOnlyBackend(httpcore.AnyIOBackend):
+    """Network backend that connects only to validated, public addresses."""
+
+    async def connect_tcp(
+        self,
+        host: str,
+        port: int,
+        timeout: float | None = None,
+        local_address: str | None = None,
+        socket_options=None,
+    ) -> httpcore.AsyncNetworkStream:
+        last_error: Exception | None = None
+
+        for ip in await resolve_public(host.lower()):
+            try:
+                return await super().connect_tcp(
+                    str(ip),
+                    port,
+                    timeout=timeout,
+                    local_address=local_address,
+                    socket_options=socket_options,
+                )
+            except (httpcore.ConnectError, httpcore.ConnectTimeout) as e:
+                last_error = e  # try the host's next address
+
+        raise last_error
+
+
+class PinnedTransport(httpx.AsyncHTTPTransport):
+    """httpx transport whose TCP connections go to pre-validated IPs only.
+
+    The socket is opened to an address returned by resolve_public(), which
+    answers from the same cache assert_public_url() just filled — one lookup
+    per host, not two — and re-checks it, so a DNS answer that changed in
+    between can't steer the connection inward. TLS still verifies against and
+    sends SNI for the URL's hostname, and the Host header is untouched, since
+    httpcore does both above the network backend.
+    """
 
-        if _is_blocked_ip(ip):
-            raise UnsafeUrlError("Refusing to fetch an internal/loopback address.")
+    def __init__(self, http2: bool = False, limits: httpx.Limits = httpx.Limits()):
+        super().__init__(http2=http2, limits=limits)
+
+        # AsyncHTTPTransport takes no network_backend argument, so the pool it
+        # built is swapped for an identical one that uses ours
+        self._pool = httpcore.AsyncConnectionPool(
+            ssl_context=httpx.create_ssl_context(),
+            max_connections=limits.max_connections,
+            max_keepalive_connections=limits.max_keepalive_connections,
+            keepalive_expiry=limits.keepalive_expiry,
+            http2=http2,
+            network_backend=_PublicOnlyBackend(),
+        )
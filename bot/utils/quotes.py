@@ -0,0 +1,242 @@
+import asyncio
+import itertools
+from collections import Counter
+from dataclasses import dataclass
+
+from .cache import TTLCache
+from .http import http_clients
+from .metrics import metrics
+from .settings import (
+    CMC_API_BASE_URL,
+    CMC_API_KEY,
+    CMC_BATCH_WINDOW,
+    CMC_HOT_SYMBOLS,
+    CMC_QUOTE_TTL,
+)
+
+# CMC charges one credit per 100 symbols in a quotes call, so a batch is sent
+# early once it reaches that size
+MAX_SYMBOLS_PER_CALL = 100
+QUOTE_ENTRIES = 2_000
+# a symbol CMC doesn't know stays unknown for a while, so spamming a typo
+# doesn't cost a credit per attempt
+UNKNOWN_SYMBOL_TTL = 600
+# the hot set is refreshed this far into the TTL, so its quotes never expire
+HOT_REFRESH_FRACTION = 0.8
+# demand halves every refresh: a symbol nobody asks about any more drops out
+# of the hot set after a few rounds instead of costing credits forever
+DEMAND_DECAY = 0.5
+MIN_DEMAND = 0.25
+
+
+class QuoteError(Exception):
+    """CoinMarketCap could not be reached or refused the call."""
+
+
+@dataclass
+class Quote:
+    symbol: str
+    price: float | None
+    market_cap: float | None
+
+
+class QuoteService:
+    """CoinMarketCap quotes, cached and fetched in batches.
+
+    Symbols asked for within the batch window — by one /price or by many at
+    once — go out as a single multi-symbol call, and concurrent askers of a
+    symbol already on its way share that call. Quotes are kept for the TTL.
+    While running, the most requested symbols are re-fetched in the
+    background shortly before they expire, so a coin everyone is asking
+    about is always answered from memory.
+    """
+
+    def __init__(self, ttl: float, batch_window: float, hot_symbols: int):
+        self._ttl = ttl
+        self._batch_window = batch_window
+        self._hot_symbols = hot_symbols
+
+        self._quotes: TTLCache[Quote] = TTLCache(QUOTE_ENTRIES, ttl)
+        self._unknown: TTLCache[bool] = TTLCache(QUOTE_ENTRIES, UNKNOWN_SYMBOL_TTL)
+        # symbol -> future of the call it is in, queued or in flight
+        self._pending: dict[str, asyncio.Future] = {}
+        self._batch: list[str] = []
+        self._flush_timer: asyncio.TimerHandle | None = None
+        self._calls: set[asyncio.Task] = set()
+
+        self._demand: Counter[str] = Counter()
+        self._refresher: asyncio.Task | None = None
+        self._hits = 0
+        self._misses = 0
+
+        metrics.gauge("cmc.quote.hit_ratio", lambda: self.hit_ratio)
+        metrics.gauge("cmc.hot_symbols", lambda: len(self._hot_set()))
+
+    @property
+    def hit_ratio(self) -> float:
+        lookups = self._hits + self._misses
+        return round(self._hits / lookups, 3) if lookups else 0.0
+
+    def start(self) -> None:
+        if self._refresher is None and self._hot_symbols > 0 and CMC_API_KEY:
+            self._refresher = asyncio.create_task(self._refresh_hot())
+
+    async def stop(self) -> None:
+        refresher, self._refresher = self._refresher, None
+        if refresher is not None:
+            refresher.cancel()
+            await asyncio.gather(refresher, return_exceptions=True)
+
+    async def get_quotes(self, symbols: list[str]) -> dict[str, Quote | None]:
+        """Quotes by upper-cased symbol, None for symbols CMC doesn't know.
+
+        Raises QuoteError if a quote had to be fetched and the call failed.
+        """
+        wanted = list(dict.fromkeys(symbol.upper() for symbol in symbols))
+        quotes: dict[str, Quote | None] = {}
+        missing = []
+
+        for symbol in wanted:
+            self._demand[symbol] += 1
+
+            quote = self._quotes.get(symbol)
+            if quote is not None or self._unknown.get(symbol):
+                self._hits += 1
+                metrics.incr("cmc.quote.hit")
+                quotes[symbol] = quote
+            else:
+                self._misses += 1
+                metrics.incr("cmc.quote.miss")
+                missing.append(symbol)
+
+        fetched = await asyncio.gather(*(self._fetch(symbol) for symbol in missing))
+        quotes.update(zip(missing, fetched))
+
+        return {symbol: quotes[symbol] for symbol in wanted}
+
+    async def _fetch(self, symbol: str) -> Quote | None:
+        future = self._pending.get(symbol)
+
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            # nobody may be left awaiting it (all cancelled), so the exception
+            # is marked retrieved here instead of logged at garbage collection
+            future.add_done_callback(lambda f: f.cancelled() or f.exception())
+            self._pending[symbol] = future
+            self._batch.append(symbol)
+
+            if len(self._batch) >= MAX_SYMBOLS_PER_CALL:
+                self._flush()
+            elif self._flush_timer is None:
+                loop = asyncio.get_running_loop()
+                self._flush_timer = loop.call_later(self._batch_window, self._flush)
+
+        # shielded: one cancelled /price must not fail everyone sharing the call
+        return await asyncio.shield(future)
+
+    def _flush(self) -> None:
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+
+        batch, self._batch = self._batch, []
+        if batch:
+            task = asyncio.create_task(self._call(batch))
+            self._calls.add(task)
+            task.add_done_callback(self._calls.discard)
+
+    async def _call(self, symbols: list[str]) -> None:
+        metrics.incr("cmc.calls")
+        metrics.observe("cmc.batch_size", len(symbols))
+
+        try:
+            quotes = await self._request(symbols)
+        except Exception as e:
+            error = e if isinstance(e, QuoteError) else QuoteError(str(e))
+            for symbol in symbols:
+                self._settle(symbol, error=error)
+            return
+
+        for symbol in symbols:
+            quote = quotes.get(symbol)
+            if quote is None:
+                self._unknown.set(symbol, True)
+            else:
+                self._quotes.set(symbol, quote)
+            self._settle(symbol, quote=quote)
+
+    def _settle(
+        self,
+        symbol: str,
+        quote: Quote | None = None,
+        error: Exception | None = None,
+    ) -> None:
+        future = self._pending.pop(symbol)
+        if future.done():
+            return
+
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(quote)
+
+    async def _request(self, symbols: list[str]) -> dict[str, Quote]:
+        response = await http_clients.cmc.get(
+            f"{CMC_API_BASE_URL}/v1/cryptocurrency/quotes/latest",
+            params={
+                "symbol": ",".join(symbols),
+                "convert": "USD",
+                # without it one unknown symbol fails the whole batch
+                "skip_invalid": "true",
+            },
+            headers={"X-CMC_PRO_API_KEY": CMC_API_KEY},
+        )
+        try:
+            body = response.json()
+        except ValueError:
+            body = {}  # a proxy's error page, not CMC's JSON
+
+        status = body.get("status") or {}
+        credits = status.get("credit_count") or 0
+        metrics.incr("cmc.credits", credits)
+
+        if response.status_code != 200:
+            message = status.get("error_message") or f"HTTP {response.status_code}"
+            raise QuoteError(f"CoinMarketCap error: {message}")
+
+        quotes = {}
+        for symbol, coin in (body.get("data") or {}).items():
+            usd = coin["quote"]["USD"]
+            quotes[symbol.upper()] = Quote(
+                symbol=symbol.upper(),
+                price=usd.get("price"),
+                market_cap=usd.get("market_cap"),
+            )
+
+        return quotes
+
+    def _hot_set(self) -> list[str]:
+        ranked = (symbol for symbol, _ in self._demand.most_common())
+        known = (symbol for symbol in ranked if not self._unknown.get(symbol))
+        return list(itertools.islice(known, self._hot_symbols))
+
+    async def _refresh_hot(self) -> None:
+        while True:
+            await asyncio.sleep(self._ttl * HOT_REFRESH_FRACTION)
+
+            results = await asyncio.gather(
+                *(self._fetch(symbol) for symbol in self._hot_set()),
+                return_exceptions=True,
+            )
+            for error in results:
+                if isinstance(error, Exception):
+                    print(f"Quote refresh failed: {error}")
+                    break
+
+            for symbol in list(self._demand):
+                self._demand[symbol] *= DEMAND_DECAY
+                if self._demand[symbol] < MIN_DEMAND:
+                    del self._demand[symbol]
+
+
+quote_service = QuoteService(CMC_QUOTE_TTL, CMC_BATCH_WINDOW, CMC_HOT_SYMBOLS)
@@ -1,6 +1,6 @@
 from typing import Optional
 
-from decouple import config
+from decouple import Choices, config
 
 # required
 DISCORD_TOKEN: str = config("DISCORD_TOKEN")
@@ -10,14 +10,85 @@ OPENAI_API_KEY: str = config("OPENAI_API_KEY")
 # optional
 OPENAI_CHAT_MODEL: str = config("OPENAI_CHAT_MODEL", default="gpt-5.4-mini")
 OPENAI_IMAGE_MODEL: str = config("OPENAI_IMAGE_MODEL", default="gpt-image-1.5")
+# /imagine output: webp and jpeg at this compression (0-100) are a fraction of
+# the png's size. Partial images (0-3) are shown as a preview while the final
+# one generates; 0 turns the preview off. All three apply to OpenAI only — with
+# OPENAI_API_BASE_URL set, /imagine sends none of them and gets a png
+IMAGINE_OUTPUT_FORMAT: str = config(
+    "IMAGINE_OUTPUT_FORMAT", default="webp", cast=Choices(["png", "jpeg", "webp"])
+)
+IMAGINE_OUTPUT_COMPRESSION: int = config(
+    "IMAGINE_OUTPUT_COMPRESSION", default=85, cast=int
+)
+IMAGINE_PARTIAL_IMAGES: int = config("IMAGINE_PARTIAL_IMAGES", default=2, cast=int)
 OPENAI_API_BASE_URL: Optional[str] = config("OPENAI_API_BASE_URL", default=None)
+# most OpenAI calls in flight at once; the bot backs off below this on its own
+# when the account's rate limits push back
+OPENAI_MAX_CONCURRENCY: int = config("OPENAI_MAX_CONCURRENCY", default=16, cast=int)
+OPENAI_MAX_RETRIES: int = config("OPENAI_MAX_RETRIES", default=4, cast=int)
 CMC_API_KEY: Optional[str] = config("CMC_PRO_API_KEY", default=None)
+CMC_API_BASE_URL: str = config(
+    "CMC_API_BASE_URL", default="https://pro-api.coinmarketcap.com"
+)
+# /price quotes are cached this many seconds (CMC itself updates them about
+# once a minute), and symbols asked for within the batch window share one
+# call. The most requested symbols are refreshed in the background before they
+# expire; 0 turns that off
+CMC_QUOTE_TTL: float = config("CMC_QUOTE_TTL", default=60, cast=float)
+CMC_BATCH_WINDOW: float = config("CMC_BATCH_WINDOW", default=0.05, cast=float)
+CMC_HOT_SYMBOLS: int = config("CMC_HOT_SYMBOLS", default=10, cast=int)
+# /joke answers from this many jokes fetched ahead of time; 0 fetches each one
+# on demand
+JOKE_BUFFER_DEPTH: int = config("JOKE_BUFFER_DEPTH", default=10, cast=int)
+# edit the /ask answer into Discord as it generates, instead of all at once
+ASK_STREAM_RESPONSES: bool = config("ASK_STREAM_RESPONSES", default=True, cast=bool)
+# /ask admission control: how many run at once (overall, per user, per server),
+# how many may wait in line beyond that, and for how long. The timeout stays
+# under the 15 minutes Discord allows for answering a deferred interaction
+ASK_MAX_CONCURRENT: int = config("ASK_MAX_CONCURRENT", default=8, cast=int)
+ASK_MAX_PER_USER: int = config("ASK_MAX_PER_USER", default=1, cast=int)
+ASK_MAX_PER_GUILD: int = config("ASK_MAX_PER_GUILD", default=4, cast=int)
+ASK_MAX_QUEUED: int = config("ASK_MAX_QUEUED", default=50, cast=int)
+ASK_QUEUE_TIMEOUT: float = config("ASK_QUEUE_TIMEOUT", default=600, cast=float)
+# identical /ask questions in one channel within this many seconds share one
+# answer (0 turns it off), except in the listed server ids
+ASK_COALESCE_WINDOW: float = config("ASK_COALESCE_WINDOW", default=30, cast=float)
+ASK_COALESCE_DISABLED_GUILDS: set[int] = config(
+    "ASK_COALESCE_DISABLED_GUILDS",
+    default="",
+    cast=lambda v: {int(guild_id) for guild_id in v.split(",") if guild_id.strip()},
+)
+# answers the model gave without tools or images are reused for the same
+# question for this many seconds (0 turns it off), except in the listed servers
+ASK_ANSWER_CACHE_TTL: float = config("ASK_ANSWER_CACHE_TTL", default=3600, cast=float)
+ASK_ANSWER_CACHE_DISABLED_GUILDS: set[int] = config(
+    "ASK_ANSWER_CACHE_DISABLED_GUILDS",
+    default="",
+    cast=lambda v: {int(guild_id) for guild_id in v.split(",") if guild_id.strip()},
+)
+# recent channel messages given to /ask as context, and how many channels
+# worth of them are kept in memory (least recently active evicted first)
+ASK_CONTEXT_MESSAGES: int = config("ASK_CONTEXT_MESSAGES", default=10, cast=int)
+ASK_CONTEXT_CHANNELS: int = config("ASK_CONTEXT_CHANNELS", default=500, cast=int)
+# /ask images are downscaled to fit this many pixels on their longest side and
+# re-encoded as JPEG at this quality before they are sent to the model
+ATTACHMENT_MAX_DIMENSION: int = config(
+    "ATTACHMENT_MAX_DIMENSION", default=1536, cast=int
+)
+ATTACHMENT_JPEG_QUALITY: int = config("ATTACHMENT_JPEG_QUALITY", default=85, cast=int)
+# online members named in /ask context; the rest are only counted
+ASK_CONTEXT_ONLINE_NAMES: int = config("ASK_CONTEXT_ONLINE_NAMES", default=50, cast=int)
+# estimated input tokens per /ask round; older tool results are summarized and
+# then dropped to stay under it
+ASK_INPUT_TOKEN_BUDGET: int = config("ASK_INPUT_TOKEN_BUDGET", default=32_000, cast=int)
 
 # dynamodb (credentials/region default to boto3's chain — i.e. ~/.aws/ — when unset)
 AWS_REGION: Optional[str] = config("AWS_REGION", default=None)
 AWS_ACCESS_KEY_ID: Optional[str] = config("AWS_ACCESS_KEY_ID", default=None)
 AWS_SECRET_ACCESS_KEY: Optional[str] = config("AWS_SECRET_ACCESS_KEY", default=None)
 DYNAMODB_TABLE_NAME: str = config("DYNAMODB_TABLE_NAME", default="elongpt-completions")
+# e.g. http://localhost:8000 for DynamoDB Local; unset talks to AWS
+DYNAMODB_ENDPOINT_URL: Optional[str] = config("DYNAMODB_ENDPOINT_URL", default=None)
 
 # tools (no setting this will not enable certain tools the model has)
 # web search authenticates with OPENAI_API_KEY, so it needs no key of its own
@@ -25,6 +96,28 @@ DGPT_SEARCH_URL: str = config(
     "DGPT_SEARCH_URL",
     default="https://api.deutschlandgpt.de/v2/search",
 )
+# seconds a search result is reused for; results age, so keep it short
+WEB_SEARCH_CACHE_TTL: float = config("WEB_SEARCH_CACHE_TTL", default=300, cast=float)
+# read pages longer than one extraction call in parallel parts, rather than
+# truncating them (costs one helper call per part)
+WEB_FETCH_MAP_REDUCE: bool = config("WEB_FETCH_MAP_REDUCE", default=True, cast=bool)
+# top search results fetched speculatively while the model decides which to
+# read, so a WebFetch of one of them is already done; 0 (the default) is off
+WEB_FETCH_PREFETCH_RESULTS: int = config(
+    "WEB_FETCH_PREFETCH_RESULTS", default=0, cast=int
+)
+# web page -> Markdown conversion. Streaming converts while the page downloads
+# and stops at the character budget; off, whole pages go through the tree-based
+# converter below
+WEB_FETCH_STREAM_PARSE: bool = config("WEB_FETCH_STREAM_PARSE", default=True, cast=bool)
+# tree-based conversions run in worker processes, under a memory limit and a
+# timeout that stops them. 0 workers converts in a thread instead: the queue
+# bound and timeout still apply, but a timed-out conversion keeps running in
+# its thread and there is no memory limit
+HTML_CONVERT_WORKERS: int = config("HTML_CONVERT_WORKERS", default=2, cast=int)
+HTML_CONVERT_MAX_QUEUE: int = config("HTML_CONVERT_MAX_QUEUE", default=16, cast=int)
+HTML_CONVERT_TIMEOUT: float = config("HTML_CONVERT_TIMEOUT", default=10, cast=float)
+HTML_CONVERT_MEMORY_MB: int = config("HTML_CONVERT_MEMORY_MB", default=1024, cast=int)
 EVENTS_VOICE_CHANNEL_ID: Optional[int] = config(
     "EVENTS_VOICE_CHANNEL_ID",
     default=None,
@@ -0,0 +1,141 @@
+import asyncio
+import io
+import time
+
+import discord
+
+from . import split_message
+
+# Discord allows about five edits per five seconds on a channel's messages, and
+# a long answer can be editing two of them at once. One flush a second keeps the
+# whole stream under that without the 429 retries discord.py would otherwise
+# sleep through
+STREAM_EDIT_INTERVAL = 1.0
+IMAGE_PREVIEW_NOTE = "-# Preview, still generating..."
+
+
+class FollowupStreamer:
+    """Render a growing answer as interaction follow-ups, edited in place.
+
+    push() is cheap enough to call on every token: it only records the latest
+    text and starts a background flush when the previous one is done and the
+    edit interval has passed. finish() waits for that flush and writes the
+    final text, deleting any follow-ups the final text no longer needs.
+    """
+
+    def __init__(
+        self, interaction: discord.Interaction, interval: float = STREAM_EDIT_INTERVAL
+    ):
+        self._interaction = interaction
+        self._interval = interval
+        self._messages: list[discord.WebhookMessage] = []
+        self._shown: list[str] = []
+        self._last_flush = 0.0
+        self._pending: asyncio.Task | None = None
+
+    async def push(self, text: str) -> None:
+        if self._pending is not None and not self._pending.done():
+            return
+
+        if time.monotonic() - self._last_flush < self._interval:
+            return
+
+        self._pending = asyncio.create_task(self._flush_quietly(text))
+
+    async def finish(self, text: str) -> None:
+        if self._pending is not None:
+            await self._pending
+
+        await self._flush(text)
+
+    async def _flush_quietly(self, text: str) -> None:
+        # a dropped preview edit is harmless — finish() writes the full answer
+        try:
+            await self._flush(text)
+        except discord.HTTPException as e:
+            print(f"Stream edit failed: {e}")
+
+    async def _flush(self, text: str) -> None:
+        chunks = split_message(text)
+        # mentions pinned off for the same reason as the non-streamed answer
+        no_mentions = discord.AllowedMentions.none()
+
+        for i, chunk in enumerate(chunks):
+            if i >= len(self._messages):
+                message = await self._interaction.followup.send(
+                    chunk, wait=True, allowed_mentions=no_mentions
+                )
+                self._messages.append(message)
+                self._shown.append(chunk)
+
+            # a growing answer can move an earlier cut, so every chunk is
+            # compared, not just the last one
+            elif self._shown[i] != chunk:
+                await self._messages[i].edit(
+                    content=chunk, allowed_mentions=no_mentions
+                )
+                self._shown[i] = chunk
+
+        for message in self._messages[len(chunks) :]:
+            await message.delete()
+
+        del self._messages[len(chunks) :]
+        del self._shown[len(chunks) :]
+        self._last_flush = time.monotonic()
+
+
+class FollowupImagePreview:
+    """Show partial images as one follow-up, replaced by the final image.
+
+    push() never waits on Discord: a partial that arrives while the previous
+    one is still uploading is dropped, since a better one or the final image
+    follows anyway. finish() waits for that upload and swaps in the final
+    image, reusing the preview message if there is one.
+    """
+
+    def __init__(self, interaction: discord.Interaction, filename: str):
+        self._interaction = interaction
+        self._filename = filename
+        self._message: discord.WebhookMessage | None = None
+        self._pending: asyncio.Task | None = None
+
+    async def push(self, image: bytes) -> None:
+        if self._pending is not None and not self._pending.done():
+            return
+
+        self._pending = asyncio.create_task(self._show_quietly(image))
+
+    async def finish(self, image: bytes) -> None:
+        await self._settle()
+        await self._show(image, final=True)
+
+    async def discard(self) -> None:
+        """Remove the preview, e.g. when generation failed."""
+        await self._settle()
+        if self._message is not None:
+            try:
+                await self._message.delete()
+            except discord.HTTPException as e:
+                print(f"Failed to delete image preview: {e}")
+
+    async def _settle(self) -> None:
+        if self._pending is not None:
+            await self._pending
+
+    async def _show_quietly(self, image: bytes) -> None:
+        # a dropped preview is harmless — finish() posts the final image
+        try:
+            await self._show(image, final=False)
+        except discord.HTTPException as e:
+            print(f"Image preview failed: {e}")
+
+    async def _show(self, image: bytes, final: bool) -> None:
+        file = discord.File(io.BytesIO(image), filename=self._filename)
+        content = None if final else IMAGE_PREVIEW_NOTE
+
+        if self._message is None:
+            self._message = await self._interaction.followup.send(
+                content, file=file, wait=True
+            )
+        else:
+            await self._message.edit(content=content, attachments=[file])
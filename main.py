@@ -18,4 +18,7 @@ async def on_ready():
     setup_idle_monitor(bot)
 
 
-bot.run(DISCORD_TOKEN)
+# guarded because the HTML converter's worker processes are spawned, and spawn
+# re-imports this module in each of them
+if __name__ == "__main__":
+    bot.run(DISCORD_TOKEN)
@@ -0,0 +1,100 @@
+"""Per-round cost of building the /ask request, with large images attached.
+
+Builds a Conversation with five ~2 MB base64 images and a few tool rounds,
+then times request() — what every tool round pays before the client
+serializes the body — and measures what one call allocates. For comparison
+it times rebuilding the whole conversation each round, which is what /ask
+did before Conversation existed.
+
+    python scripts/bench_ask_rounds.py [--images 5] [--image-kb 1500] [--rounds 4]
+
+Nothing is sent anywhere; the settings the bot requires are stubbed out.
+"""
+
+import argparse
+import base64
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+for name in ("DISCORD_TOKEN", "ADMIN_USER_ID", "OPENAI_API_KEY"):
+    os.environ.setdefault(name, "bench")
+
+from openai.types.chat import ChatCompletionMessage  # noqa: E402
+
+from bot.ai.chat import Conversation  # noqa: E402
+from bot.ai.tools import TOOL_DEFINITIONS  # noqa: E402
+
+
+def tool_round(index: int) -> tuple[ChatCompletionMessage, list[str]]:
+    message = ChatCompletionMessage(
+        role="assistant",
+        content=None,
+        tool_calls=[
+            {
+                "id": f"call_{index}",
+                "type": "function",
+                "function": {"name": "WebSearch", "arguments": '{"query": "x"}'},
+            }
+        ],
+    )
+    return message, [json.dumps({"query": "x", "results": ["x" * 3_000]})]
+
+
+def build(images: list[str], rounds: int) -> Conversation:
+    conversation = Conversation("question", "user", images, "context", TOOL_DEFINITIONS)
+    for index in range(rounds):
+        conversation.add_tool_round(*tool_round(index))
+
+    return conversation
+
+
+def measure(label: str, run, iterations: int) -> None:
+    # request() logs a line per call
+    with contextlib.redirect_stdout(io.StringIO()):
+        wall, cpu = time.perf_counter(), time.process_time()
+        for _ in range(iterations):
+            run()
+        wall = (time.perf_counter() - wall) / iterations
+        cpu = (time.process_time() - cpu) / iterations
+
+        tracemalloc.start()
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    print(
+        f"{label:<10} {wall * 1e6:>10.1f} us wall {cpu * 1e6:>10.1f} us cpu "
+        f"{peak / 1e3:>10.1f} KB allocated per round"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--images", type=int, default=5)
+    parser.add_argument("--image-kb", type=int, default=1_500, help="raw size")
+    parser.add_argument("--rounds", type=int, default=4)
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    images = [
+        base64.b64encode(os.urandom(args.image_kb * 1_000)).decode()
+        for _ in range(args.images)
+    ]
+    conversation = build(images, args.rounds)
+
+    print(
+        f"{args.images} images of ~{len(images[0]) / 1e6:.1f} MB base64, "
+        f"{args.rounds} tool rounds, {args.iterations} iterations"
+    )
+    measure("extend", conversation.request, args.iterations)
+    measure("rebuild", lambda: build(images, args.rounds).request(), args.iterations)
+
+
+if __name__ == "__main__":
+    main()
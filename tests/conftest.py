@@ -0,0 +1,7 @@
+import os
+
+# bot.utils.settings requires these at import time; the tests never use them
+os.environ.setdefault("DISCORD_TOKEN", "test")
+os.environ.setdefault("ADMIN_USER_ID", "1")
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("CMC_PRO_API_KEY", "test")
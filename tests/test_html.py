@@ -0,0 +1,133 @@
+import asyncio
+import threading
+
+import pytest
+
+from bot.ai import html
+from bot.ai.html import StreamingMarkdownConverter, html_to_markdown
+
+PROSE = (
+    "The committee met on Tuesday, after weeks of delay, to review the plan. "
+    "Members raised concerns about cost, scope and timing, and asked for a "
+    "revised budget before the next session."
+)
+
+PAGE = f"""<!doctype html>
+<html><head><title>Budget review</title></head>
+<body>
+<div class="top-links">
+  <a href="/a">Home</a> <a href="/b">World</a> <a href="/c">Business</a>
+</div>
+<div class="story-body">
+  <h1>Committee reviews the plan</h1>
+  {"".join(f"<p>{PROSE}</p>" for _ in range(6))}
+</div>
+<div class="more">
+  <p><a href="/x">Another story, with a comma, that is only links</a></p>
+  <p>Short note.</p>
+</div>
+</body></html>""".encode()
+
+
+def stream(html: bytes, chunk_size: int = 64) -> str:
+    converter = StreamingMarkdownConverter(budget=100_000)
+    for start in range(0, len(html), chunk_size):
+        converter.feed_bytes(html[start : start + chunk_size])
+    return converter.finish()
+
+
+def test_streaming_keeps_only_the_main_content():
+    markdown = stream(PAGE)
+
+    assert markdown.startswith("# Budget review\n\n# Committee reviews the plan")
+    assert markdown.count("The committee met on Tuesday") == 6
+    assert "Home" not in markdown
+    assert "Another story" not in markdown
+
+
+def test_streaming_agrees_with_the_tree_converter():
+    tree = html_to_markdown(PAGE)
+
+    assert "Home" not in tree
+    assert tree.startswith("# Budget review")
+
+
+def test_streaming_converts_the_whole_page_without_a_clear_winner():
+    page = b"<html><body><div><p>Just a short page.</p></div>" b"</body></html>"
+
+    assert stream(page) == "Just a short page."
+
+
+def test_streaming_keeps_a_list_paragraph_on_its_bullet():
+    page = b"<ul><li><p>Step one</p></li><li>\n  <p>Step two</p></li></ul>"
+
+    assert stream(page) == "- Step one\n\n- Step two"
+
+
+def test_streaming_reports_a_page_cut_at_the_budget():
+    converter = StreamingMarkdownConverter(budget=len(PROSE) * 4)
+    converter.feed_bytes(PAGE)
+    markdown = converter.finish()
+
+    assert converter.done and converter.truncated
+    assert markdown.count("The committee met on Tuesday") < 6
+
+    whole = StreamingMarkdownConverter(budget=100_000)
+    whole.feed_bytes(PAGE)
+    whole.finish()
+    assert not whole.truncated
+
+
+def wrapped(attributes: str) -> bytes:
+    body = "".join(f"<p>{PROSE}</p>" for _ in range(6))
+    return (
+        f"<html><head><title>Budget review</title></head><body>"
+        f"<div {attributes}><div class='story-body'>{body}</div>"
+        f"<div class='sidebar'><p>{PROSE.upper()}</p></div></div>"
+        f"</body></html>"
+    ).encode()
+
+
+@pytest.mark.parametrize(
+    "attributes", ['class="layout with-sidebar"', 'id="disqus-thread-host"']
+)
+@pytest.mark.parametrize("convert", [stream, html_to_markdown])
+def test_a_pruned_page_wrapper_falls_back_to_the_unpruned_page(convert, attributes):
+    markdown = convert(wrapped(attributes))
+
+    assert markdown.count("The committee met on Tuesday") == 6
+
+
+@pytest.mark.parametrize("convert", [stream, html_to_markdown])
+def test_hinted_boilerplate_is_pruned_around_the_main_content(convert):
+    markdown = convert(wrapped('class="layout"'))
+
+    assert markdown.startswith("# Budget review")
+    assert markdown.count("The committee met on Tuesday") == 6
+    assert "THE COMMITTEE" not in markdown
+
+
+def test_thread_conversion_times_out_and_keeps_its_slot(monkeypatch):
+    release = threading.Event()
+
+    def slow(html: bytes) -> str:
+        release.wait(5)
+        return "late"
+
+    monkeypatch.setattr(html, "html_to_markdown", slow)
+    monkeypatch.setattr(html, "HTML_CONVERT_TIMEOUT", 0.05)
+    converter = html.HtmlConverter(workers=0, max_pending=1)
+
+    async def main():
+        with pytest.raises(html.HtmlConversionError, match="too long"):
+            await converter.convert(b"<p>x</p>")
+
+        # the timed-out thread is still running, so the queue is still full
+        with pytest.raises(html.HtmlConversionError, match="busy"):
+            await converter.convert(b"<p>x</p>")
+
+        release.set()
+        await asyncio.sleep(0.1)
+        assert converter._pending == 0
+
+    asyncio.run(main())
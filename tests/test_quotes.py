@@ -0,0 +1,119 @@
+import asyncio
+
+import httpx
+import pytest
+
+from bot.utils.http import http_clients
+from bot.utils.quotes import QuoteError, QuoteService
+
+
+def cmc_response(symbols: list[str], unknown: set[str] = frozenset()) -> httpx.Response:
+    data = {
+        symbol: {"quote": {"USD": {"price": 2.5, "market_cap": 1000.0}}}
+        for symbol in symbols
+        if symbol not in unknown
+    }
+    return httpx.Response(200, json={"status": {"credit_count": 1}, "data": data})
+
+
+@pytest.fixture
+def cmc(monkeypatch):
+    """Route the CMC pool to a handler; yields the symbol lists it was asked for."""
+    calls: list[list[str]] = []
+    handlers = []
+
+    def dispatch(request: httpx.Request) -> httpx.Response:
+        symbols = request.url.params["symbol"].split(",")
+        calls.append(symbols)
+        return handlers[0](symbols)
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(dispatch))
+    monkeypatch.setitem(http_clients._clients, "cmc", client)
+
+    def use(handler):
+        handlers[:] = [handler]
+        return calls
+
+    return use
+
+
+def test_concurrent_lookups_share_one_call(cmc):
+    calls = cmc(cmc_response)
+    service = QuoteService(ttl=60, batch_window=0.01, hot_symbols=0)
+
+    async def main():
+        return await asyncio.gather(
+            service.get_quotes(["btc", "eth"]),
+            service.get_quotes(["BTC", "sol"]),
+        )
+
+    first, second = asyncio.run(main())
+
+    assert calls == [["BTC", "ETH", "SOL"]]
+    assert list(first) == ["BTC", "ETH"]
+    assert list(second) == ["BTC", "SOL"]
+    assert first["BTC"].price == 2.5
+    assert first["BTC"].market_cap == 1000.0
+
+
+def test_cached_quotes_need_no_call(cmc):
+    calls = cmc(cmc_response)
+    service = QuoteService(ttl=60, batch_window=0.01, hot_symbols=0)
+
+    async def main():
+        await service.get_quotes(["BTC"])
+        return await service.get_quotes(["btc"])
+
+    quotes = asyncio.run(main())
+
+    assert len(calls) == 1
+    assert quotes["BTC"].price == 2.5
+    assert service.hit_ratio == 0.5
+
+
+def test_unknown_symbols_are_cached(cmc):
+    calls = cmc(lambda symbols: cmc_response(symbols, unknown={"NOPE"}))
+    service = QuoteService(ttl=60, batch_window=0.01, hot_symbols=0)
+
+    async def main():
+        first = await service.get_quotes(["NOPE", "BTC"])
+        second = await service.get_quotes(["nope"])
+        return first, second
+
+    first, second = asyncio.run(main())
+
+    assert first["NOPE"] is None
+    assert first["BTC"] is not None
+    assert second == {"NOPE": None}
+    assert len(calls) == 1
+
+
+def test_api_errors_become_quote_errors(cmc):
+    cmc(
+        lambda symbols: httpx.Response(
+            401,
+            json={"status": {"error_message": "API key missing.", "credit_count": 0}},
+        )
+    )
+    service = QuoteService(ttl=60, batch_window=0.01, hot_symbols=0)
+
+    with pytest.raises(QuoteError, match="API key missing"):
+        asyncio.run(service.get_quotes(["BTC"]))
+
+
+def test_failures_are_not_cached(cmc):
+    responses = iter(
+        [lambda symbols: httpx.Response(502, text="Bad Gateway"), cmc_response]
+    )
+    calls = cmc(lambda symbols: next(responses)(symbols))
+    service = QuoteService(ttl=60, batch_window=0.01, hot_symbols=0)
+
+    async def main():
+        with pytest.raises(QuoteError, match="HTTP 502"):
+            await service.get_quotes(["BTC"])
+        return await service.get_quotes(["BTC"])
+
+    quotes = asyncio.run(main())
+
+    assert quotes["BTC"].price == 2.5
+    assert len(calls) == 2
@@ -0,0 +1,230 @@
+import asyncio
+import json
+import time
+
+import httpx
+import openai
+import pytest
+from openai import AsyncOpenAI
+
+from bot.ai import ratelimit
+from bot.ai.ratelimit import BACKGROUND, INTERACTIVE, RateLimitGate, _parse_duration
+
+COMPLETION = {
+    "id": "chatcmpl-1",
+    "object": "chat.completion",
+    "created": 0,
+    "model": "test",
+    "choices": [
+        {
+            "index": 0,
+            "message": {"role": "assistant", "content": "hi"},
+            "finish_reason": "stop",
+        }
+    ],
+}
+
+
+def make_client(gate: RateLimitGate, handler) -> AsyncOpenAI:
+    """An OpenAI client whose requests are answered by `handler`."""
+
+    async def observe(response: httpx.Response) -> None:
+        gate.observe(response)
+
+    http_client = httpx.AsyncClient(
+        transport=httpx.MockTransport(handler), event_hooks={"response": [observe]}
+    )
+    return AsyncOpenAI(api_key="test", max_retries=0, http_client=http_client)
+
+
+def create(client: AsyncOpenAI, **options):
+    return lambda: client.chat.completions.create(
+        model="test", messages=[{"role": "user", "content": "hi"}], **options
+    )
+
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(ratelimit, "RETRY_BASE_DELAY", 0.01)
+
+
+def test_parse_duration():
+    assert _parse_duration("6m0s") == 360
+    assert _parse_duration("1.5s") == 1.5
+    assert _parse_duration("20ms") == pytest.approx(0.02)
+    assert _parse_duration("") is None
+    assert _parse_duration("soon") is None
+    assert _parse_duration("1.2.3s") is None
+
+
+def test_ignores_malformed_rate_limit_headers():
+    gate = RateLimitGate(max_concurrency=8, max_retries=0)
+    headers = {
+        "x-ratelimit-remaining-requests": "unlimited",
+        "x-ratelimit-remaining-tokens": "12.5",
+        "x-ratelimit-reset-tokens": "1.2.3s",
+    }
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, json=COMPLETION, headers=headers)
+
+    async def main():
+        client = make_client(gate, handler)
+        return await gate.call(create(client))
+
+    completion = asyncio.run(main())
+
+    assert completion.choices[0].message.content == "hi"
+    assert gate._remaining_requests is None
+    assert gate._remaining_tokens is None
+
+
+def test_retries_rate_limit_and_halves_the_limit():
+    gate = RateLimitGate(max_concurrency=8, max_retries=3)
+    attempts = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        attempts.append(time.monotonic())
+        if len(attempts) == 1:
+            return httpx.Response(429, headers={"retry-after-ms": "50"})
+        return httpx.Response(200, json=COMPLETION)
+
+    async def main():
+        client = make_client(gate, handler)
+        return await gate.call(create(client))
+
+    completion = asyncio.run(main())
+
+    assert completion.choices[0].message.content == "hi"
+    assert len(attempts) == 2
+    assert attempts[1] - attempts[0] >= 0.05  # waited out retry-after
+    assert gate._limit == 4 + 1 / 4  # halved, then grown by the success
+    assert gate._in_flight == 0
+
+
+def test_gives_up_after_max_retries():
+    gate = RateLimitGate(max_concurrency=4, max_retries=2)
+    attempts = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        attempts.append(request)
+        return httpx.Response(503, json={"error": {"message": "down"}})
+
+    async def main():
+        client = make_client(gate, handler)
+        await gate.call(create(client))
+
+    with pytest.raises(openai.InternalServerError):
+        asyncio.run(main())
+
+    assert len(attempts) == 3
+    assert gate._in_flight == 0
+
+
+def test_does_not_retry_client_errors():
+    gate = RateLimitGate(max_concurrency=4, max_retries=3)
+    attempts = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        attempts.append(request)
+        return httpx.Response(400, json={"error": {"message": "bad request"}})
+
+    async def main():
+        client = make_client(gate, handler)
+        await gate.call(create(client))
+
+    with pytest.raises(openai.BadRequestError):
+        asyncio.run(main())
+
+    assert len(attempts) == 1
+    assert gate._in_flight == 0
+
+
+def test_waits_for_the_request_budget_to_reset():
+    gate = RateLimitGate(max_concurrency=4, max_retries=0)
+    sent = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        sent.append(time.monotonic())
+        headers = {
+            "x-ratelimit-remaining-requests": "0",
+            "x-ratelimit-reset-requests": "100ms",
+        }
+        return httpx.Response(200, json=COMPLETION, headers=headers)
+
+    async def main():
+        client = make_client(gate, handler)
+        await gate.call(create(client), priority=INTERACTIVE)
+        await gate.call(create(client), priority=INTERACTIVE)
+
+    asyncio.run(main())
+
+    assert sent[1] - sent[0] >= 0.09
+
+
+def test_admits_interactive_calls_before_background_ones():
+    gate = RateLimitGate(max_concurrency=1, max_retries=0)
+    order = []
+
+    async def main():
+        release = asyncio.Event()
+
+        async def blocker():
+            await release.wait()
+
+        async def record(name):
+            order.append(name)
+
+        holding = asyncio.create_task(gate.call(blocker))
+        await asyncio.sleep(0)
+
+        background = asyncio.create_task(
+            gate.call(lambda: record("background"), priority=BACKGROUND)
+        )
+        await asyncio.sleep(0)
+        interactive = asyncio.create_task(
+            gate.call(lambda: record("interactive"), priority=INTERACTIVE)
+        )
+        await asyncio.sleep(0)
+
+        release.set()
+        await asyncio.gather(holding, background, interactive)
+
+    asyncio.run(main())
+
+    assert order == ["interactive", "background"]
+
+
+def test_stream_holds_its_slot_until_read():
+    gate = RateLimitGate(max_concurrency=1, max_retries=0)
+    chunk = {
+        "id": "chatcmpl-1",
+        "object": "chat.completion.chunk",
+        "created": 0,
+        "model": "test",
+        "choices": [{"index": 0, "delta": {"content": "hi"}, "finish_reason": None}],
+    }
+    body = f"data: {json.dumps(chunk)}\n\ndata: [DONE]\n\n"
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if json.loads(request.content).get("stream"):
+            return httpx.Response(
+                200, content=body, headers={"content-type": "text/event-stream"}
+            )
+        return httpx.Response(200, json=COMPLETION)
+
+    async def main():
+        client = make_client(gate, handler)
+
+        async with gate.stream(create(client, stream=True)) as stream:
+            other = asyncio.create_task(gate.call(create(client)))
+            await asyncio.sleep(0.05)
+            assert not other.done()  # the stream is still being read
+
+            deltas = [c.choices[0].delta.content async for c in stream]
+
+        await other
+        return deltas
+
+    assert asyncio.run(main()) == ["hi"]
+    assert gate._in_flight == 0